@@ -1,20 +1,29 @@
-from pytket import Circuit, OpType
-from pytket.device import Device
-from pytket.passes import FullPeepholeOptimise, SequencePass, PauliSimp, RebaseQuil, RebaseCirq, RebaseIBM, CXMappingPass, SynthesiseIBM
-from pytket.predicates import CompilationUnit
-from pytket.routing import Architecture, GraphPlacement
-from pytket.qasm import circuit_from_qasm
-
-import os, pandas, time, itertools, docker
-from numpy import nan
+# pandas (and numpy) are needed by every run, to read the config and
+# write results. Compiler modules are only imported by the adapters in
+# compilers.py once a compiler is configured.
+import os, pandas, itertools, hashlib, json, multiprocessing
+from functools import lru_cache
+from numpy import nan, isnan
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, FIRST_COMPLETED, wait
 
 import getopt
 import sys
 
-_BACKEND_FULL = "full"
-_BACKEND_GOOGLE = "google"
-_BACKEND_IBM = "ibm"
-_BACKEND_RIGETTI = "rigetti"
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "utils"))
+from result_sink import ResultWriter, columnar_formats
+from circuit_cache import CircuitCache
+from cost_model import CostModel
+from qasm_scan import scan_qasm, scan_metrics
+from import_profile import profile_imports, breakdown
+from measure import median_sample, summarise
+from supervise import run_supervised, STATUS_OK, STATUS_ERROR, STATUS_TIMEOUT, STATUS_OOM, STATUS_SKIPPED
+import devices
+import compilers
+
+_BACKEND_FULL = devices.BACKEND_FULL
+_BACKEND_GOOGLE = devices.BACKEND_GOOGLE
+_BACKEND_IBM = devices.BACKEND_IBM
+_BACKEND_RIGETTI = devices.BACKEND_RIGETTI
 
 backend_outfile_str = {
     _BACKEND_FULL : "FullConnectivity",
@@ -23,21 +32,17 @@ backend_outfile_str = {
     _BACKEND_RIGETTI : "Aspen"
 }
 
-_COMPILER_TKET = "tket"
-_COMPILER_QISKIT = "qiskit"
-_COMPILER_QUILC = "quilc"
+_COMPILER_TKET = compilers.COMPILER_TKET
+_COMPILER_QISKIT = compilers.COMPILER_QISKIT
+_COMPILER_QUILC = compilers.COMPILER_QUILC
 
-compiler_outfile_str = {
-    _COMPILER_TKET : "Tket",
-    _COMPILER_QISKIT : "Qiskit",
-    _COMPILER_QUILC : "Quilc"
-}
+compiler_outfile_str = {name : adapter.outfile_str for name, adapter in compilers.adapters.items()}
 
-_PASS_FULLPASS = "FullPass"
-_PASS_CHEMPASS = "ChemPass"
-_PASS_QISO1 = "qisO1"
-_PASS_QISO2 = "qisO2"
-_PASS_QISO3 = "qisO3"
+_PASS_FULLPASS = compilers.PASS_FULLPASS
+_PASS_CHEMPASS = compilers.PASS_CHEMPASS
+_PASS_QISO1 = compilers.PASS_QISO1
+_PASS_QISO2 = compilers.PASS_QISO2
+_PASS_QISO3 = compilers.PASS_QISO3
 
 pass_outfile_str = {
     _PASS_FULLPASS : "Full",
@@ -57,14 +62,26 @@ set_outfile_str = {
 }
 
 def usage():
-    print("usage: {source} [-c <compiler>] [-b <backend>] [-p <pass>] [-s <set>]".format(source=sys.argv[0]))
-    print("<compiler> = {tket} (default), {qiskit}, {quilc}".format(tket=_COMPILER_TKET, qiskit=_COMPILER_QISKIT, quilc=_COMPILER_QUILC))
+    print("usage: {source} [-c <compiler>] [-b <backend>] [-p <pass>] [-s <set>] [-j <workers>] [-f <format>] [-r] [-Q <command>] [-t] [--repeat <K>] [--warmup <W>] [--timeout <seconds>] [--max-rss <MiB>] [--sweep <spec>] [--import-profile] [--batch]".format(source=sys.argv[0]))
+    print("<compiler> = {tket} (default), {others}".format(tket=_COMPILER_TKET, others=", ".join(c for c in compilers.adapters if c != _COMPILER_TKET)))
     print("<backend> = {full} (default), {google}, {ibm}, {rigetti}".format(full=_BACKEND_FULL, google=_BACKEND_GOOGLE, ibm=_BACKEND_IBM, rigetti=_BACKEND_RIGETTI))
     print("<pass> = {full} (default), {chem}, {qisO1}, {qisO2}, {qisO3}".format(full=_PASS_FULLPASS, chem=_PASS_CHEMPASS, qisO1=_PASS_QISO1, qisO2=_PASS_QISO2, qisO3=_PASS_QISO3))
     print("<set> = {all} (default), {uccsd}".format(all=_SET_ALL, uccsd=_SET_UCCSD))
+    print("<workers> = number of worker processes, 1 (default) runs serially; for {quilc}, the number of quilc servers".format(quilc=_COMPILER_QUILC))
+    print("<format> = columnar format written alongside the CSV: {formats}".format(formats=", ".join(columnar_formats)))
+    print("-r resumes from an existing results file, only compiling circuits that are missing or have changed")
+    print("<command> = local command that starts a quilc server, used instead of docker containers; its {port} placeholder is replaced by the port to listen on, e.g. \"python quilc_stub.py {port}\"")
+    print("-t applies the {tket} passes one stage at a time and records the time, memory and gate counts after each stage".format(tket=_COMPILER_TKET))
+    print("<K> = number of timed compilations of each circuit, 1 (default)")
+    print("<W> = number of untimed warm-up compilations of each circuit, 0 (default)")
+    print("<seconds> = wall-clock limit on compiling each circuit, none (default)")
+    print("<MiB> = resident memory limit on compiling each circuit, none (default)")
+    print("<spec> = JSON file of lists of compilers, passes, backends and sets; every valid combination is run in this process, replacing -c, -p, -b and -s")
+    print("--batch compiles all circuits of a run in one call of compilers that support it ({batched}), which parallelise over all cores themselves".format(batched=", ".join(c for c, a in compilers.adapters.items() if a.batched)))
+    print("--import-profile records the time spent importing modules at start-up for each compiler, in a side-car *_Imports.csv")
 
 try:
-    opts, args = getopt.getopt(sys.argv[1:], "c:b:p:s:")
+    opts, args = getopt.getopt(sys.argv[1:], "c:b:p:s:j:f:rQ:t", ["repeat=", "warmup=", "timeout=", "max-rss=", "sweep=", "import-profile", "batch"])
 except getopt.GetoptError as err:
     print(err)
     usage()
@@ -74,10 +91,22 @@ compiler = _COMPILER_TKET
 backend = _BACKEND_FULL
 comp_pass = _PASS_FULLPASS
 test_set = _SET_ALL
+n_workers = 1
+columnar = None
+resume = False
+quilc_command = None
+instrument = False
+n_repeat = 1
+n_warmup = 0
+timeout = None
+max_rss = None
+sweep_spec = None
+import_profile = False
+batch = False
 
 for o, v in opts:
     if o == '-c':
-        if v in (_COMPILER_TKET, _COMPILER_QISKIT, _COMPILER_QUILC):
+        if v in compilers.adapters:
             compiler = v
         else:
             print("invalid compiler: {v}".format(v=v))
@@ -104,236 +133,474 @@ for o, v in opts:
             print("invalid test set: {v}".format(v=v))
             usage()
             exit()
-
-if compiler == _COMPILER_QUILC:
-    from pytket.pyquil import tk_to_pyquil, pyquil_to_tk
-
-    import pyquil
-    from pyquil.api import QVMCompiler
-    from pyquil.api._config import PyquilConfig
-    from pyquil import Program, get_qc
-    from pyquil.device import isa_from_graph, Device as Device_
-    import networkx as nx
-
-    comp_pass = ""
-    
-elif compiler == _COMPILER_QISKIT:
-    from pytket.qiskit import tk_to_qiskit, qiskit_to_tk
-
-    from qiskit import QuantumCircuit
-    from qiskit.compiler import transpile
-    from qiskit.transpiler import CouplingMap
-
-    if comp_pass == _PASS_FULLPASS: # Default
-        comp_pass = _PASS_QISO3
-
-outfile = "{set}Results_{comp}_{cpass}_{back}.csv".format(
-    set=set_outfile_str[test_set],
-    comp=compiler_outfile_str[compiler],
-    cpass=pass_outfile_str[comp_pass],
-    back=backend_outfile_str[backend])
-
-### optimisation passes:
-tketpass = FullPeepholeOptimise()
-if compiler == _COMPILER_TKET and comp_pass == _PASS_CHEMPASS:
-    tketpass = SequencePass([PauliSimp(), FullPeepholeOptimise()])
-
-all_to_all_coupling = list()
-for i in range(53):
-    for j in range(i+1,53):
-        all_to_all_coupling.append([i,j])
-
-rigetti_coupling = [[0, 1], [1,2], [2,3], [3, 4], [4, 5], [5, 6], [6, 7], [7, 0],
-                    [8, 9], [9, 10], [10, 11], [11, 12], [12, 13], [13, 14], [14, 15], [15, 8],
-                    [2, 15], [3, 14]]
-
-google_coupling = [[0, 5], [1, 5], [1, 6], [2, 6], [2, 7], [3, 8], [3, 9], [4, 9], [4,
-                    10], [5, 11], [5, 12], [6, 12], [6, 13], [7, 13], [7, 14], [8, 14],
-                    [8, 15], [9, 15], [9, 16], [10, 16], [11, 17], [12, 17], [12, 18],
-                    [13, 18], [13, 19], [14, 19], [14, 20], [15, 20], [15, 21], [16, 21],
-                    [16, 22], [17, 23], [17, 24], [18, 24], [18, 25], [19, 25], [19, 26],
-                    [20, 26], [20, 27], [21, 27], [21, 28], [22, 28], [23, 29], [24, 29],
-                    [24, 30], [25, 30], [25, 31], [26, 31], [26, 32], [27, 32], [27, 33],
-                    [28, 33], [28, 34], [29, 35], [29, 36], [30, 36], [30, 37], [31, 37],
-                    [31, 38], [32, 38], [32, 39], [33, 39], [33, 40], [34, 40], [35, 41],
-                    [36, 41], [36, 42], [37, 42], [37, 43], [38, 43], [38, 44], [39, 44],
-                    [39, 45], [40, 45], [40, 46], [41, 47], [41, 48], [42, 48], [42, 49],
-                    [43, 49], [43, 50], [44, 50], [44, 51], [45, 51], [45, 52], [46, 52],
-                    [47, 53], [48, 53], [48, 54], [49, 54], [49, 55], [50, 55], [50, 56],
-                    [51, 56], [51, 57], [52, 57], [52, 58]]
-
-ibm_coupling = [[0, 5],[0, 1],[1, 2],[1, 0],[2, 3],[2,
-            1],[3, 4], [3, 2], [4, 6], [4, 3], [5, 9], [5, 0], [6,
-            13], [6, 4], [7, 16], [7, 8], [8, 9], [8, 7], [9, 10], [9,
-            8], [9, 5], [10, 11], [10, 9], [11, 17], [11, 12], [11,
-            10], [12, 13], [12, 11], [13, 14], [13, 12], [13, 6], [14,
-            15], [14, 13], [15, 18], [15, 14], [16, 19], [16, 7], [17,
-            23], [17, 11], [18, 27], [18, 15], [19, 20], [19, 16],
-            [20, 21], [20, 19], [21, 28], [21, 22], [21, 20], [22,
-            23], [22, 21], [23, 24], [23, 22], [23, 17], [24, 25],
-            [24, 23], [25, 29], [25, 26], [25, 24], [26, 27], [26,
-            25], [27, 26], [27, 18], [28, 32], [28, 21], [29, 36],
-            [29, 25], [30, 39], [30, 31], [31, 32], [31, 30], [32,
-            33], [32, 31], [32, 28], [33, 34], [33, 32], [34, 40],
-            [34, 35], [34, 33], [35, 36], [35, 34], [36, 37], [36,
-            35], [36, 29], [37, 38], [37, 36], [38, 41], [38, 37],
-            [39, 42], [39, 30], [40, 46], [40, 34], [41, 50], [41,
-            38], [42, 43], [42, 39], [43, 44], [43, 42], [44, 51],
-            [44, 45], [44, 43], [45, 46], [45, 44], [46, 47], [46,
-            45], [46, 40], [47, 48], [47, 46], [48, 52], [48, 49],
-            [48, 47], [49, 50], [49, 48], [50, 49], [50, 41], [51,
-            44], [52, 48]]
-
-### devices:
-rigetti_device = Device(Architecture(rigetti_coupling))
-google_sycamore_device = Device(Architecture(google_coupling))
-ibm_rochester_device = Device(Architecture(ibm_coupling))
-all_device = Device(Architecture(all_to_all_coupling))
-
-
-def gen_tket_pass(optimisepass,backend:str):
-    if backend == _BACKEND_FULL:
-        return optimisepass
-    elif backend == _BACKEND_RIGETTI:
-        final_pass = RebaseQuil()
-        device = rigetti_device
-    elif backend == _BACKEND_GOOGLE:
-        final_pass = RebaseCirq()
-        device = google_sycamore_device
-    elif backend == _BACKEND_IBM: 
-        final_pass = RebaseIBM()
-        device = ibm_rochester_device
-    mapper = CXMappingPass(device, GraphPlacement(device))
-    total_pass = SequencePass([optimisepass,mapper,SynthesiseIBM(),final_pass])
-    return total_pass
-
-def run_tket_pass(circ:Circuit,total_pass,backend:str):
-    try:
-        cu = CompilationUnit(circ)
-        start_time = time.process_time()
-        total_pass.apply(cu)
-        time_elapsed = time.process_time() - start_time
-        print(time_elapsed)
-        circ2 = cu.circuit
-        if backend in (_BACKEND_GOOGLE, _BACKEND_RIGETTI):
-            two_qb_gate = OpType.CZ
+    elif o == '-j':
+        if v.isdigit() and int(v) > 0:
+            n_workers = int(v)
         else:
-            two_qb_gate = OpType.CX
-        return [circ2.n_gates, circ2.depth(), circ2.n_gates_of_type(two_qb_gate), circ2.depth_by_type(two_qb_gate), time_elapsed]
-    except Exception as e :
-        print(e)
-        print("t|ket> error")
-        return [nan,nan,nan,nan,nan]
-
-def run_qiskit_pass(fpath:str,backend:str):
+            print("invalid number of workers: {v}".format(v=v))
+            usage()
+            exit()
+    elif o == '-f':
+        if v in columnar_formats:
+            columnar = v
+        else:
+            print("invalid format: {v}".format(v=v))
+            usage()
+            exit()
+    elif o == '-r':
+        resume = True
+    elif o == '-Q':
+        quilc_command = v
+    elif o == '-t':
+        instrument = True
+    elif o == '--repeat':
+        if v.isdigit() and int(v) > 0:
+            n_repeat = int(v)
+        else:
+            print("invalid number of repeats: {v}".format(v=v))
+            usage()
+            exit()
+    elif o == '--warmup':
+        if v.isdigit():
+            n_warmup = int(v)
+        else:
+            print("invalid number of warm-up runs: {v}".format(v=v))
+            usage()
+            exit()
+    elif o in ('--timeout', '--max-rss'):
+        try:
+            limit = float(v)
+        except ValueError:
+            limit = 0
+        if limit <= 0:
+            print("invalid limit: {v}".format(v=v))
+            usage()
+            exit()
+        if o == '--timeout':
+            timeout = limit
+        else:
+            max_rss = limit
+    elif o == '--sweep':
+        sweep_spec = v
+    elif o == '--import-profile':
+        import_profile = True
+    elif o == '--batch':
+        batch = True
+
+def resolve_pass(name:str, cpass:str):
+    # The pass a compiler actually runs when asked for `cpass`
+    return compilers.adapters[name].resolve_pass(cpass)
+
+def configure(comp:str, back:str, cpass:str, tset:str):
+    # Sets up this module to benchmark one combination of compiler,
+    # backend, pass and test set
+    global compiler, backend, comp_pass, test_set, compiler_version, adapter
+    global configfile, filepath, outfile, stagefile, cost_model
+    compiler, backend, comp_pass, test_set = comp, back, resolve_pass(comp, cpass), tset
+    adapter = compilers.adapters[compiler](comp_pass, repeat=n_repeat, warmup=n_warmup, instrument=instrument)
+    compiler_version = adapter.version()
+
+    if test_set == _SET_ALL:
+        configfile = "tket_paper_config.csv"
+        filepath = "qasm_files"
+    elif test_set == _SET_UCCSD:
+        configfile = "chem_config.csv"
+        filepath = "chem_qasm"
+
+    outfile = "{set}Results_{comp}_{cpass}_{back}.csv".format(
+        set=set_outfile_str[test_set],
+        comp=compiler_outfile_str[compiler],
+        cpass=pass_outfile_str[comp_pass],
+        back=backend_outfile_str[backend])
+    stagefile = os.path.splitext(outfile)[0] + "_Stages.csv"
+    # Compile times are predicted from earlier results of the same
+    # compiler on this set. They are read here, before the results file
+    # of this combination is opened and, unless resuming, truncated.
+    history_pattern = "{set}Results_{comp}_*.csv".format(
+        set=set_outfile_str[test_set],
+        comp=compiler_outfile_str[compiler])
+    cost_model = CostModel(load_set(configfile, filepath)[0])
+    n_history = cost_model.load_results(history_pattern)
+    print("Cost model: {n} earlier compile times".format(n=n_history))
+
+    # The devices and passes are built here, before any worker processes
+    # are forked, so that the workers inherit them
+    adapter.prepare(backend)
+
+# 'Time elapsed' keeps the measure each compiler has always been reported
+# with (process CPU time for tket and qiskit, request wall time for quilc)
+# for comparison with published results. The remaining timing columns are
+# measured the same way for every compiler. Over repeated compilations,
+# 'Time elapsed' and the timing columns are medians, 'Time min' and
+# 'Time IQR' summarise the 'Time elapsed' measure, and 'Deterministic'
+# records whether every repetition gave the same gate metrics. 'Status'
+# tells compile errors apart from compilations that were stopped for
+# running out of time (TIMEOUT) or memory (OOM), and from circuits too
+# large for the backend (SKIPPED). In --batch mode circuits are compiled
+# together, so their timing and memory columns are left empty, and 'Pass
+# time' holds the median total of the circuit's pass times as reported by
+# the compiler. It is empty otherwise, so the two kinds of row are never
+# compared by mistake.
+metric_columns = ['Gate count', 'Depth', '2qb gate count', '2qb depth', 'T count', 'Time elapsed', 'Pass time', 'Wall time', 'CPU time', 'Child CPU time', 'Remote CPU time', 'Peak RSS (MiB)', 'Time min', 'Time IQR', 'Noisy', 'Deterministic', 'Status']
+
+# A compile time is flagged as noisy when its interquartile range is more
+# than this fraction of its median
+_NOISE_THRESHOLD = 0.1
+
+def failed_metrics(status:str=STATUS_ERROR):
+    return [nan] * (len(metric_columns) - 1) + [status]
+
+def run_metrics(metrics:list,times:list,samples:list,pass_times:list=None):
+    # Reduces the gate metrics and measurements of all repetitions. The
+    # gate metrics of each circuit come from a single pass over its
+    # commands (see utils/circuit_metrics.py).
+    all_metrics = [[m.n_gates, m.depth, m.n_2qb_gates, m.depth_2qb, m.t_count] for m in metrics]
+    deterministic = all(m == all_metrics[0] for m in all_metrics)
+    if not deterministic:
+        print("gate metrics differ between repetitions")
+    summary = summarise(times)
+    noisy = summary.spread > _NOISE_THRESHOLD * summary.median if not isnan(summary.median) else nan
+    pass_time = nan if pass_times is None else summarise(pass_times).median
+    return all_metrics[-1] + [summary.median, pass_time] + list(median_sample(samples)) + [summary.minimum, summary.spread, noisy, deterministic, STATUS_OK]
+
+def compiled_metrics(compiled):
+    # The metric columns of a compilation, or of the exception it raised
     try:
-        qsc = QuantumCircuit.from_qasm_file(fpath)
-        if backend == _BACKEND_IBM:
-            basis_gates = ['u1','u2','u3','cx']
-            two_qb_gate = OpType.CX
-            cm = CouplingMap(ibm_coupling)
-        elif backend == _BACKEND_RIGETTI:
-            basis_gates = ['u1','u2','u3','cx']
-            two_qb_gate = OpType.CX
-            cm = CouplingMap(rigetti_coupling)
-        elif backend == _BACKEND_GOOGLE:
-            basis_gates = ['u1','u2','u3','cx']
-            two_qb_gate = OpType.CX
-            cm = CouplingMap(google_coupling)
-        else: # _BACKEND_FULL
-            basis_gates = ['u1','u2','u3','cx']
-            two_qb_gate = OpType.CX
-            cm = None
-        if comp_pass == _PASS_QISO1:
-            opt_level = 1
-        elif comp_pass == _PASS_QISO2:
-            opt_level = 2
-        elif comp_pass == _PASS_QISO3:
-            opt_level = 3
-        start_time = time.process_time()
-        qsc2 = transpile(qsc,basis_gates=basis_gates,coupling_map=cm,optimization_level=opt_level)
-        time_elapsed = time.process_time() - start_time
-        print(time_elapsed)
-        circ2 = qiskit_to_tk(qsc2)
-        return [circ2.n_gates, circ2.depth(), circ2.n_gates_of_type(two_qb_gate), circ2.depth_by_type(two_qb_gate), time_elapsed]
-    except Exception as e :
+        if isinstance(compiled, Exception):
+            raise compiled
+        print(compiled.times)
+        return run_metrics([adapter.metrics(c) for c in compiled.circuits], compiled.times, compiled.samples, compiled.pass_times)
+    except TimeoutError as e :
         print(e)
-        print("qiskit error")
-        return [nan,nan,nan,nan,nan]
-    
-def run_quilc_pass(circ:Circuit,backend:str):
-    try:
-        RebaseQuil().apply(circ)
-        p_circ = tk_to_pyquil(circ)
-        if backend == _BACKEND_IBM:
-            devgraph = nx.from_edgelist(ibm_coupling)
-            twoq_type = ['CZ']
-            twoq_set = {OpType.CZ}
-        elif backend == _BACKEND_RIGETTI:
-            devgraph = nx.from_edgelist(rigetti_coupling)
-            twoq_type = ['CZ', 'XY']
-            twoq_set = {OpType.CZ, OpType.ISWAP}
-        elif backend == _BACKEND_GOOGLE:
-            devgraph = nx.from_edgelist(google_coupling)
-            twoq_type = ['CZ']
-            twoq_set = {OpType.CZ}
-        elif backend == _BACKEND_FULL:
-            devgraph = nx.complete_graph(circ.n_qubits)
-            twoq_type = ['CZ', 'XY']
-            twoq_set = {OpType.CZ, OpType.ISWAP}
-        isa = isa_from_graph(devgraph, twoq_type=twoq_type)
-        device = Device_("dev", {"isa" : isa.to_dict()})
-        device._isa = isa
-        qcompiler = QVMCompiler(PyquilConfig().quilc_url, device, timeout=600)
-        start_time = time.time()
-        compiled_pr = qcompiler.quil_to_native_quil(p_circ)
-        time_elapsed = time.time() - start_time
-        print(time_elapsed)
-        circ2 = pyquil_to_tk(compiled_pr)
-        return [circ2.n_gates, circ2.depth(), sum(circ2.n_gates_of_type(op) for op in twoq_set), circ2.depth_by_type(twoq_set), time_elapsed]
+        print("{compiler} timeout".format(compiler=compiler))
+        return failed_metrics(STATUS_TIMEOUT)
+    except MemoryError as e :
+        print(e)
+        print("{compiler} out of memory".format(compiler=compiler))
+        return failed_metrics(STATUS_OOM)
     except Exception as e :
         print(e)
-        print("quilc error")
-        return [nan,nan,nan,nan,nan]
-
-stat_table = pandas.DataFrame({})
+        print("{compiler} error".format(compiler=compiler))
+        return failed_metrics()
 
-if test_set == _SET_ALL:
-    test_table = pandas.read_csv("tket_paper_config.csv")
-    filepath = "qasm_files"
-elif test_set == _SET_UCCSD:
-    test_table = pandas.read_csv("chem_config.csv")
-    filepath = "chem_qasm"
+# The adapter configured by `configure`. Worker processes inherit it,
+# with its prepared devices and passes, as they are always forked (see
+# `run_configuration`).
+adapter = None
+circuit_cache = None
 
-total_pass = gen_tket_pass(tketpass,backend)
+def init_worker():
+    global circuit_cache
+    circuit_cache = CircuitCache()
 
-if compiler == _COMPILER_QUILC:
-    dock = docker.from_env()
-    qvm_container = dock.containers.run(image="rigetti/qvm", command="-S", detach=True, ports={5000:5000}, remove=True)
-    quilc_container = dock.containers.run(image="rigetti/quilc:1.16.3", command="-R", detach=True, ports={5555:5555}, remove=True)
-    time.sleep(4) # Give it time to boot up and start the servers
+# In a sweep, the inputs of the test set being run are loaded once for
+# each compiler, and shared by all of its combinations
+loaded_inputs = dict()
 
-for index, row in test_table.iterrows():
-    print(index)
-    filename = row['Filename']
+def load_input(filename:str, fhash:str=None):
     fpath = os.path.join(filepath, filename)
-    circ = circuit_from_qasm(fpath)
-    if backend == _BACKEND_RIGETTI and circ.n_qubits > 16:
-        results = [[filename] + [nan,nan,nan,nan,nan]]
+    if (compiler, fhash) in loaded_inputs:
+        return loaded_inputs[(compiler, fhash)]
+    return adapter.load(fpath, lambda: circuit_cache.load(fpath, fhash))
+
+def compiled_result(filename:str, compiled):
+    # The result row, and the per-stage rows in instrumented mode
+    stage_rows = list() if isinstance(compiled, Exception) else compiled.stage_rows
+    return [filename] + compiled_metrics(compiled), stage_rows
+
+def run_job(filename:str, fhash:str=None):
+    try:
+        source = load_input(filename, fhash)
+    except Exception as e :
+        return compiled_result(filename, e)
+    return compiled_result(filename, adapter.compile_batch([source])[0])
+
+def run_batch(filenames:list, hashes:dict):
+    # Compiles all of `filenames` with one call of the adapter, returning
+    # the job result of each
+    compiled = dict()
+    sources = dict()
+    for filename in filenames:
+        try:
+            sources[filename] = load_input(filename, hashes[filename])
+        except Exception as e :
+            compiled[filename] = e
+    compiled.update(zip(sources, adapter.compile_batch(list(sources.values()))))
+    return [compiled_result(filename, compiled[filename]) for filename in filenames]
+
+def check_size(filename:str, n_qubits:int):
+    # Returns the row of a circuit too large for the backend, or None if
+    # it can be compiled. Raises if it is too large for any backend.
+    if backend == _BACKEND_RIGETTI and n_qubits > 16:
+        return [filename] + failed_metrics(STATUS_SKIPPED)
+    if n_qubits > 53:
+        raise Exception("Greater than 53 qubits: " + filename)
+    return None
+
+def run_supervised_job(filename:str, fhash:str=None):
+    # With a time or memory limit, each tket or qiskit job runs in its own
+    # supervised child process. Remote compilers such as quilc compile in
+    # their servers, which time out their own requests.
+    if adapter.remote or (timeout is None and max_rss is None):
+        return run_job(filename, fhash)
+    status, job_result = run_supervised(run_job, (filename, fhash), timeout, max_rss)
+    if status != STATUS_OK:
+        print("{filename}: {status}".format(filename=filename, status=status))
+        return [filename] + failed_metrics(status), list()
+    return job_result
+
+def file_hash(fpath:str):
+    with open(fpath, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+result_columns = ['Filename'] + metric_columns + ['File hash', 'Compiler version']
+stage_columns = ['Filename', 'Repetition', 'Stage', 'Wall time', 'CPU time', 'Peak RSS (MiB)', 'Gate count', '2qb gate count']
+
+sweep_columns = ['Set', 'Compiler', 'Pass', 'Backend']
+
+def sweep_combinations(spec_file:str):
+    # The valid (compiler, backend, pass, set) combinations of a sweep spec,
+    # grouped by set so that each set's circuits are only loaded once
+    with open(spec_file) as f:
+        spec = json.load(f)
+    choices = {
+        'compilers' : ([compiler], tuple(compilers.adapters)),
+        'backends' : ([backend], (_BACKEND_FULL, _BACKEND_IBM, _BACKEND_GOOGLE, _BACKEND_RIGETTI)),
+        'passes' : ([comp_pass], (_PASS_FULLPASS, _PASS_CHEMPASS, _PASS_QISO1, _PASS_QISO2, _PASS_QISO3)),
+        'sets' : ([test_set], (_SET_ALL, _SET_UCCSD)),
+    }
+    values = dict()
+    for key, (default, allowed) in choices.items():
+        values[key] = spec.get(key, default)
+        for v in values[key]:
+            if v not in allowed:
+                raise ValueError("invalid {key} in {spec}: {v}".format(key=key, spec=spec_file, v=v))
+    combinations = list()
+    for tset in values['sets']:
+        for comp in values['compilers']:
+            for back in values['backends']:
+                for cpass in values['passes']:
+                    cpass = resolve_pass(comp, cpass)
+                    # Each compiler only runs its own passes, e.g. tket
+                    # its passes and qiskit its optimisation levels
+                    if cpass not in compilers.adapters[comp].passes:
+                        continue
+                    if (comp, back, cpass, tset) not in combinations:
+                        combinations.append((comp, back, cpass, tset))
+    return combinations
+
+@lru_cache(maxsize=None)
+def load_set(configfile:str, filepath:str):
+    # The config, file hashes and pre-scans of a test set
+    test_table = pandas.read_csv(configfile)
+    hashes = {filename : file_hash(os.path.join(filepath, filename)) for filename in test_table['Filename']}
+    # Circuits are pre-scanned to filter out those too large for the
+    # backend before any of them are parsed
+    scans = {filename : scan_qasm(os.path.join(filepath, filename)) for filename in test_table['Filename']}
+    # The scans also size the jobs for the cost model wherever the config
+    # lacks a metric, or was built from an older version of the file
+    if 'File hash' in test_table.columns:
+        stale = [str(h) != hashes[filename] for filename, h in zip(test_table['Filename'], test_table['File hash'])]
+    else:
+        stale = [False] * len(test_table)
+    scanned = {
+        'Gate count' : lambda scan: scan_metrics(scan)[0],
+        '2qb gate count' : lambda scan: scan_metrics(scan)[1],
+        'Qubits' : lambda scan: scan.n_qubits,
+    }
+    for column, metric in scanned.items():
+        values = [metric(scans[filename]) for filename in test_table['Filename']]
+        if column not in test_table.columns:
+            test_table[column] = values
+        else:
+            test_table[column] = [v if s else old for v, s, old in zip(values, stale, test_table[column])]
+    return test_table, hashes, scans
+
+def preload_circuits(names:set):
+    # Loads every circuit of the configured test set once for each of the
+    # compilers `names`, for all the combinations of a sweep to share. Each
+    # circuit is only parsed by pytket once.
+    test_table, hashes, scans = load_set(configfile, filepath)
+    loaders = {name : compilers.adapters[name]() for name in names}
+    cache = CircuitCache()
+    loaded_inputs.clear()
+    for filename in test_table['Filename']:
+        if scans[filename].n_qubits > 53:
+            continue
+        fpath = os.path.join(filepath, filename)
+        fhash = hashes[filename]
+        parsed = list()
+        def parse():
+            if not parsed:
+                parsed.append(cache.load(fpath, fhash))
+            return parsed[0].copy()
+        for name, loader in loaders.items():
+            try:
+                loaded_inputs[(name, fhash)] = loader.load(fpath, parse)
+            except Exception as e :
+                # Left for the job to load, and report the error
+                print("{filename}: {e}".format(filename=filename, e=e))
+
+def _key_value(v):
+    # Empty fields, such as quilc's pass, are read back as NaN
+    return "" if isinstance(v, float) and isnan(v) else str(v)
+
+def run_configuration(writer:ResultWriter, stage_writer:ResultWriter=None, key:list=None, position:int=None):
+    # Compiles every circuit of the configured combination, writing each
+    # row prefixed by `key`. In a sweep, `position` orders the rows of
+    # each combination within the shared result file.
+    key = list() if key is None else key
+    test_table, hashes, scans = load_set(configfile, filepath)
+    base = () if position is None else (position,)
+    n_key = len(key)
+
+    # The compiler, pass and backend are fixed by the output file (or the
+    # key), so a previous result can be reused as long as the circuit and
+    # the compiler version are unchanged. Failed compilations (ERROR,
+    # TIMEOUT, OOM) are run again, e.g. with a larger --timeout.
+    completed = dict()
+    for prev in writer.existing.to_dict('records'):
+        if [_key_value(prev[c]) for c in sweep_columns[:n_key]] != [str(k) for k in key]:
+            continue
+        if prev['Status'] not in (STATUS_OK, STATUS_SKIPPED):
+            continue
+        if str(prev['File hash']) == hashes.get(prev['Filename']) and str(prev['Compiler version']) == compiler_version:
+            completed[prev['Filename']] = [prev[c] for c in writer.columns]
+    jobs = list()
+    skipped = list()
+    for index, row in test_table.iterrows():
+        if row['Filename'] in completed:
+            writer.keep(completed[row['Filename']], base + (index,))
+            continue
+        size_row = check_size(row['Filename'], scans[row['Filename']].n_qubits)
+        if size_row is None:
+            jobs.append((index, row['Filename']))
+        else:
+            skipped.append((index, row['Filename'], size_row))
+    if stage_writer is not None:
+        config_index = {filename : index for index, filename in enumerate(test_table['Filename'])}
+        for i, prev in enumerate(stage_writer.existing.to_dict('records')):
+            if [_key_value(prev[c]) for c in sweep_columns[:n_key]] != [str(k) for k in key]:
+                continue
+            if prev['Filename'] in completed:
+                stage_writer.keep([prev[c] for c in stage_writer.columns], base + (config_index[prev['Filename']], i))
+    if resume:
+        print("Resuming: {done} circuits complete, {todo} to run".format(done=len(test_table) - len(jobs) - len(skipped), todo=len(jobs)))
+
+    def record(index, filename, job_result):
+        row, stage_rows = job_result
+        results = [row + [hashes[filename], compiler_version]]
+        new_table_row = pandas.DataFrame(results, columns = result_columns)
+        print(new_table_row)
+        writer.write(key + results[0], base + (index,))
+        for i, stage_row in enumerate(stage_rows):
+            stage_writer.write(key + [filename] + stage_row, base + (index, i))
+        return results[0]
+
+    for index, filename, row in skipped:
+        record(index, filename, (row, list()))
+
+    if jobs:
+        adapter.start_servers(n_workers, timeout, quilc_command)
+
+    if batch and adapter.batched:
+        # The compiler spreads the batch over the cores itself, so -j and
+        # the per-job limits do not apply
+        init_worker()
+        results = run_batch([filename for _, filename in jobs], hashes)
+        for (index, filename), job_result in zip(jobs, results):
+            print(index)
+            record(index, filename, job_result)
+    elif n_workers == 1:
+        init_worker()
+        for index, filename in jobs:
+            print(index)
+            record(index, filename, run_supervised_job(filename, hashes[filename]))
     else:
-        if circ.n_qubits > 53:
-            raise Exception("Greater than 53 qubits: " + filename)
-        if compiler == _COMPILER_TKET:
-            results = [[filename] + run_tket_pass(circ,total_pass,backend)]
-        elif compiler == _COMPILER_QISKIT:
-            results = [[filename] + run_qiskit_pass(fpath,backend)]
-        elif compiler == _COMPILER_QUILC:
-            results = [[filename] + run_quilc_pass(circ,backend)]
-    new_table_row = pandas.DataFrame(results, columns = ['Filename','Gate count', 'Depth', '2qb gate count', '2qb depth', 'Time elapsed'])
-    print(new_table_row)
-    stat_table = stat_table.append(new_table_row)
-    stat_table.to_csv(outfile, index=False)
-
-if compiler == _COMPILER_QUILC:
-    qvm_container.stop()
-    quilc_container.stop()
+        # Jobs finish out of order, so each row is tagged with its config
+        # index and the table is put back in config order at the end.
+        # Jobs are handed out longest predicted compile time first, so
+        # that the largest circuits don't hold up the end of the run.
+        # Only as many jobs as there are workers are handed out at a
+        # time, and the cost model learns from every finished job.
+        if adapter.remote:
+            # The compilation happens in the compiler's servers, so threads
+            # sharing them are enough to keep them all busy
+            init_worker()
+            executor = ThreadPoolExecutor(max_workers=n_workers)
+        else:
+            # The workers are forked, whatever the platform's default start
+            # method, so that they inherit the prepared adapter
+            executor = ProcessPoolExecutor(max_workers=n_workers, initializer=init_worker, mp_context=multiprocessing.get_context("fork"))
+        pending = dict((filename, index) for index, filename in jobs)
+        with executor:
+            running = dict()
+            while pending or running:
+                for filename in cost_model.longest_first(list(pending))[:n_workers - len(running)]:
+                    running[executor.submit(run_supervised_job, filename, hashes[filename])] = (pending.pop(filename), filename)
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    index, filename = running.pop(future)
+                    print(index)
+                    row = record(index, filename, future.result())
+                    if row[result_columns.index('Status')] == STATUS_OK:
+                        cost_model.observe(filename, row[result_columns.index('Wall time')])
+
+import_columns = ['Compiler', 'Module', 'Self time (ms)', 'Cumulative time (ms)']
+
+def write_import_profile(path:str, names:list):
+    # Profiles a fresh interpreter importing this script and each
+    # compiler's modules, i.e. the start-up a run or a worker pays before
+    # compiling anything. Each row is a module imported by this script
+    # directly, or by the compiler adapter.
+    bench_dir = os.path.dirname(os.path.abspath(__file__))
+    with ResultWriter(path, import_columns) as import_writer:
+        for comp in names:
+            code = "import sys; sys.argv = ['bench.py']; import bench; bench.compilers.adapters[{comp!r}].import_modules()".format(comp=comp)
+            rows = breakdown(profile_imports(code, cwd=bench_dir), "bench")
+            print("{comp} start-up imports: {ms:.1f} ms".format(comp=comp, ms=sum(e.cumulative_us for e in rows) / 1e3))
+            for e in rows:
+                import_writer.write([comp, e.module, e.self_us / 1e3, e.cumulative_us / 1e3])
+        import_writer.finalise()
+
+if __name__ == "__main__":
+    # Servers such as quilc's are stopped however the run ends
+    try:
+        if sweep_spec is None:
+            configure(compiler, backend, comp_pass, test_set)
+            with ResultWriter(outfile, result_columns, columnar, resume) as writer:
+                stage_writer = ResultWriter(stagefile, stage_columns, columnar, resume) if instrument else None
+                run_configuration(writer, stage_writer)
+                stat_table = writer.finalise()
+                if instrument:
+                    stage_writer.finalise()
+            if import_profile:
+                write_import_profile(os.path.splitext(outfile)[0] + "_Imports.csv", [compiler])
+        else:
+            # A sweep runs every combination of its spec in this process, so
+            # imports, QASM parsing and device set-up are only paid once. Each
+            # test set's circuits are loaded once and shared by all of its
+            # combinations. All results go to one file next to the spec.
+            combinations = sweep_combinations(sweep_spec)
+            sweep_outfile = os.path.splitext(sweep_spec)[0] + "_Results.csv"
+            sweep_stagefile = os.path.splitext(sweep_spec)[0] + "_Results_Stages.csv"
+            print("Sweep: {n} combinations".format(n=len(combinations)))
+            with ResultWriter(sweep_outfile, sweep_columns + result_columns, columnar, resume) as writer:
+                stage_writer = ResultWriter(sweep_stagefile, sweep_columns + stage_columns, columnar, resume) if instrument else None
+                loaded_set = None
+                for position, (comp, back, cpass, tset) in enumerate(combinations):
+                    print("{comp} {cpass} {back} {tset}".format(comp=comp, cpass=cpass, back=back, tset=tset))
+                    configure(comp, back, cpass, tset)
+                    if tset != loaded_set:
+                        preload_circuits({c[0] for c in combinations if c[3] == tset})
+                        loaded_set = tset
+                    run_configuration(writer, stage_writer, [tset, comp, comp_pass, back], position)
+                stat_table = writer.finalise()
+                if instrument:
+                    stage_writer.finalise()
+            if import_profile:
+                sweep_compilers = list(dict.fromkeys(c[0] for c in combinations))
+                write_import_profile(os.path.splitext(sweep_spec)[0] + "_Imports.csv", sweep_compilers)
+    finally:
+        for adapter_class in compilers.adapters.values():
+            adapter_class.stop_servers()
@@ -0,0 +1,386 @@
+# Compiler adapters for bench.py.
+#
+# Everything bench.py needs to know about a compiler is behind a
+# `CompilerAdapter`:
+#
+#   prepare(backend)       builds what all compilations for a backend
+#                          share, e.g. the device, passes or coupling map
+#   load(fpath, parse)     the compiler's input for a circuit, read from
+#                          its QASM file or from the parsed pytket circuit
+#   compile_batch(inputs)  compiles a list of inputs, each `warmup` times
+#                          untimed and then `repeat` times timed
+#   metrics(compiled)      the gate metrics of a compiled circuit
+#
+# `compile_batch` returns one `Compiled` per input, or the exception its
+# compilation raised, so that one failure does not lose the rest of the
+# batch. Taking whole batches lets an adapter share work between the
+# circuits of a batch. Each adapter only imports its compiler's modules
+# when it is first created. A new compiler is added by subclassing
+# `CompilerAdapter` and registering it in `adapters`.
+
+from collections import namedtuple
+import math, multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+from importlib.metadata import version as distribution_version
+
+from pytket import OpType
+from circuit_metrics import circuit_metrics
+from measure import Sample, measure, measure_once
+import devices
+
+COMPILER_TKET = "tket"
+COMPILER_QISKIT = "qiskit"
+COMPILER_QUILC = "quilc"
+
+PASS_FULLPASS = "FullPass"
+PASS_CHEMPASS = "ChemPass"
+PASS_QISO1 = "qisO1"
+PASS_QISO2 = "qisO2"
+PASS_QISO3 = "qisO3"
+
+# The compiled circuits and measurements of every timed repetition, the
+# per-stage rows of an instrumented compilation, and the compiler's own
+# account of its time where that is all there is (batch mode)
+Compiled = namedtuple("Compiled", ["circuits", "samples", "times", "stage_rows", "pass_times"], defaults=(None,))
+
+
+class CompilerAdapter:
+    name = None
+    outfile_str = None
+    # The passes the compiler can run
+    passes = ()
+    # Compiles in a server outside the benchmarking process, so jobs need
+    # neither worker processes nor supervision
+    remote = False
+    # Shares enough work between the circuits of a batch that batch mode
+    # hands it every circuit of a run at once
+    batched = False
+
+    def __init__(self, comp_pass:str=None, repeat:int=1, warmup:int=0, instrument:bool=False):
+        self.import_modules()
+        self.comp_pass = comp_pass
+        self.repeat = repeat
+        self.warmup = warmup
+        self.instrument = instrument
+        self.backend = None
+
+    @staticmethod
+    def import_modules():
+        pass
+
+    @classmethod
+    def resolve_pass(cls, cpass:str):
+        # The pass the compiler actually runs when asked for `cpass`
+        return cpass
+
+    def version(self):
+        raise NotImplementedError
+
+    def two_qb_gates(self):
+        raise NotImplementedError
+
+    def elapsed(self, sample:Sample):
+        # The measure compile times are reported in
+        return sample.cpu
+
+    def prepare(self, backend:str):
+        self.backend = backend
+
+    def load(self, fpath:str, parse):
+        # `parse()` returns the circuit parsed by pytket
+        return parse()
+
+    def compile_batch(self, inputs:list):
+        return [self._attempt(self.compile_one, source) for source in inputs]
+
+    def compile_one(self, source):
+        raise NotImplementedError
+
+    def to_tket(self, compiled):
+        return compiled
+
+    def metrics(self, compiled):
+        return circuit_metrics(self.to_tket(compiled), self.two_qb_gates())
+
+    @classmethod
+    def start_servers(cls, n_workers:int, timeout:float=None, command:str=None):
+        pass
+
+    @classmethod
+    def stop_servers(cls):
+        pass
+
+    @staticmethod
+    def _attempt(fn, source):
+        try:
+            return fn(source)
+        except Exception as e:
+            return e
+
+
+def n_2qb_gates(circ):
+    return sum(1 for cmd in circ.get_commands() if len(cmd.qubits) == 2)
+
+
+def apply_tket_stages(cu, stages:list, stage_rows:list):
+    # Applies each stage in turn, recording its measurement and the gate
+    # counts it leaves behind. Returns the measurement of all the stages.
+    stage_samples = list()
+    for name, p in stages:
+        _, sample = measure_once(p.apply, (cu,))
+        circ = cu.circuit
+        stage_rows.append([name, sample.wall, sample.cpu, sample.peak_rss, circ.n_gates, n_2qb_gates(circ)])
+        stage_samples.append(sample)
+    wall, cpu, child_cpu, remote_cpu, peak_rss = zip(*stage_samples)
+    return Sample(sum(wall), sum(cpu), sum(child_cpu), sum(remote_cpu), max(peak_rss))
+
+
+class TketAdapter(CompilerAdapter):
+    name = COMPILER_TKET
+    outfile_str = "Tket"
+    passes = (PASS_FULLPASS, PASS_CHEMPASS)
+
+    @staticmethod
+    def import_modules():
+        global FullPeepholeOptimise, SequencePass, PauliSimp, RebaseQuil, RebaseCirq, RebaseIBM, CXMappingPass, SynthesiseIBM
+        global CompilationUnit, GraphPlacement
+        from pytket.passes import FullPeepholeOptimise, SequencePass, PauliSimp, RebaseQuil, RebaseCirq, RebaseIBM, CXMappingPass, SynthesiseIBM
+        from pytket.predicates import CompilationUnit
+        from pytket.routing import GraphPlacement
+
+    def version(self):
+        return distribution_version("pytket")
+
+    def two_qb_gates(self):
+        if self.backend in (devices.BACKEND_GOOGLE, devices.BACKEND_RIGETTI):
+            return {OpType.CZ}
+        return {OpType.CX}
+
+    def prepare(self, backend:str):
+        super().prepare(backend)
+        self.stages = self.gen_stages()
+        self.total_pass = SequencePass([p for _, p in self.stages])
+
+    def gen_stages(self):
+        # The named passes making up the tket compilation, in order
+        stages = list()
+        if self.comp_pass == PASS_CHEMPASS:
+            stages.append(("PauliSimp", PauliSimp()))
+        stages.append(("FullPeepholeOptimise", FullPeepholeOptimise()))
+        if self.backend == devices.BACKEND_FULL:
+            return stages
+        elif self.backend == devices.BACKEND_RIGETTI:
+            final_stage = ("RebaseQuil", RebaseQuil())
+        elif self.backend == devices.BACKEND_GOOGLE:
+            final_stage = ("RebaseCirq", RebaseCirq())
+        elif self.backend == devices.BACKEND_IBM:
+            final_stage = ("RebaseIBM", RebaseIBM())
+        device = devices.tket_device(self.backend)
+        mapper = CXMappingPass(device, GraphPlacement(device))
+        stages += [("CXMappingPass", mapper), ("SynthesiseIBM", SynthesiseIBM()), final_stage]
+        return stages
+
+    def compile_one(self, circ):
+        # Each repetition compiles a fresh CompilationUnit
+        stage_rows = list()
+        if not self.instrument:
+            def compile_cu(cu):
+                self.total_pass.apply(cu)
+                return cu
+            results, samples = measure(compile_cu, setup=lambda: CompilationUnit(circ), repeat=self.repeat, warmup=self.warmup)
+        else:
+            for _ in range(self.warmup):
+                apply_tket_stages(CompilationUnit(circ), self.stages, list())
+            results = list()
+            samples = list()
+            for rep in range(self.repeat):
+                cu = CompilationUnit(circ)
+                rep_rows = list()
+                samples.append(apply_tket_stages(cu, self.stages, rep_rows))
+                stage_rows.extend([rep] + r for r in rep_rows)
+                results.append(cu)
+        return Compiled([cu.circuit for cu in results], samples, [self.elapsed(sample) for sample in samples], stage_rows)
+
+
+# Per-circuit pass times of the batch being transpiled. The array is
+# shared memory, and transpile's worker processes are forked after it is
+# made, so the callback can add to it from whichever process compiles
+# the circuit.
+_pass_times = None
+_batch_index = None
+
+def _record_pass_time(**kwargs):
+    # transpile callback, called after every pass
+    i = _batch_index.get(kwargs['dag'].name)
+    if i is not None:
+        _pass_times[i] += kwargs['time_taken']
+
+
+class QiskitAdapter(CompilerAdapter):
+    name = COMPILER_QISKIT
+    outfile_str = "Qiskit"
+    passes = (PASS_QISO1, PASS_QISO2, PASS_QISO3)
+    batched = True
+
+    basis_gates = ['u1', 'u2', 'u3', 'cx']
+    opt_levels = {PASS_QISO1 : 1, PASS_QISO2 : 2, PASS_QISO3 : 3}
+
+    @staticmethod
+    def import_modules():
+        global tk_to_qiskit, qiskit_to_tk, QuantumCircuit, transpile
+        from pytket.qiskit import tk_to_qiskit, qiskit_to_tk
+        from qiskit import QuantumCircuit
+        from qiskit.compiler import transpile
+
+    @classmethod
+    def resolve_pass(cls, cpass:str):
+        if cpass == PASS_FULLPASS: # Default
+            return PASS_QISO3
+        return cpass
+
+    def version(self):
+        return distribution_version("qiskit-terra")
+
+    def two_qb_gates(self):
+        return {OpType.CX}
+
+    def prepare(self, backend:str):
+        super().prepare(backend)
+        self.coupling_map = devices.qiskit_coupling_map(backend)
+
+    def load(self, fpath:str, parse):
+        return QuantumCircuit.from_qasm_file(fpath)
+
+    def compile_one(self, qsc):
+        opt_level = self.opt_levels[self.comp_pass]
+        results, samples = measure(lambda: transpile(qsc, basis_gates=self.basis_gates, coupling_map=self.coupling_map, optimization_level=opt_level), repeat=self.repeat, warmup=self.warmup)
+        return Compiled(results, samples, [self.elapsed(sample) for sample in samples], list())
+
+    def compile_batch(self, inputs:list):
+        if len(inputs) == 1:
+            return super().compile_batch(inputs)
+        try:
+            return self.transpile_batch(inputs)
+        except Exception as e :
+            # One bad circuit fails the whole call, so the circuits are
+            # compiled one at a time instead to find it
+            print("batch transpile failed, compiling one at a time: {e}".format(e=e))
+            return super().compile_batch(inputs)
+
+    def transpile_batch(self, inputs:list):
+        # Transpiles the whole batch in one call for each repetition, which
+        # qiskit spreads over all cores. Time and memory are only measured
+        # for the whole batch, so each circuit's are left empty. Its pass
+        # times, as reported to the transpile callback, are given instead.
+        global _pass_times, _batch_index
+        opt_level = self.opt_levels[self.comp_pass]
+        # Circuits are told apart in the callback by name
+        named = [qsc.copy(name="bench_{i}".format(i=i)) for i, qsc in enumerate(inputs)]
+        _batch_index = {qsc.name : i for i, qsc in enumerate(named)}
+        results = [list() for _ in inputs]
+        pass_times = [list() for _ in inputs]
+        for rep in range(self.warmup + self.repeat):
+            _pass_times = multiprocessing.RawArray('d', len(inputs))
+            compiled, batch_sample = measure_once(lambda: transpile(named, basis_gates=self.basis_gates, coupling_map=self.coupling_map, optimization_level=opt_level, callback=_record_pass_time))
+            print("transpiled {n} circuits in {wall:.2f} s, {passes:.2f} s in passes".format(n=len(inputs), wall=batch_sample.wall, passes=sum(_pass_times)))
+            if rep < self.warmup:
+                continue
+            for i, qsc in enumerate(compiled):
+                results[i].append(qsc)
+                pass_times[i].append(_pass_times[i])
+        unmeasured = Sample(math.nan, math.nan, math.nan, math.nan, math.nan)
+        return [Compiled(r, [unmeasured] * len(r), [math.nan] * len(r), list(), p) for r, p in zip(results, pass_times)]
+
+    def to_tket(self, compiled):
+        return qiskit_to_tk(compiled)
+
+
+class QuilcAdapter(CompilerAdapter):
+    name = COMPILER_QUILC
+    outfile_str = "Quilc"
+    passes = ("",)
+    remote = True
+
+    # One pool of quilc servers serves every quilc combination of a run
+    pool = None
+
+    @staticmethod
+    def import_modules():
+        global RebaseQuil, tk_to_pyquil, pyquil_to_tk
+        global QuilcServerPool, DockerLauncher, CommandLauncher, QVM_IMAGE, QUILC_IMAGE
+        from pytket.passes import RebaseQuil
+        from pytket.pyquil import tk_to_pyquil, pyquil_to_tk
+        from quilc_servers import QuilcServerPool, DockerLauncher, CommandLauncher, QVM_IMAGE, QUILC_IMAGE
+
+    @classmethod
+    def resolve_pass(cls, cpass:str):
+        return ""
+
+    def version(self):
+        return QUILC_IMAGE.split(":")[1]
+
+    def elapsed(self, sample:Sample):
+        # Quilc compiles in its server, so requests are timed by the clock
+        return sample.wall
+
+    def two_qb_gates(self):
+        if self.backend in (devices.BACKEND_IBM, devices.BACKEND_GOOGLE):
+            return {OpType.CZ}
+        return {OpType.CZ, OpType.ISWAP}
+
+    @classmethod
+    def start_servers(cls, n_workers:int, timeout:float=None, command:str=None):
+        # A pool of quilc servers, one per worker. `command` replaces the
+        # docker containers with a local command.
+        if cls.pool is not None:
+            return
+        cls.import_modules()
+        pool_options = dict() if timeout is None else {"compile_timeout" : timeout}
+        if command is None:
+            cls.pool = QuilcServerPool(n_workers, qvm_launcher=DockerLauncher(QVM_IMAGE, "-S", 5000), **pool_options)
+        else:
+            cls.pool = QuilcServerPool(n_workers, CommandLauncher(command), **pool_options)
+        cls.pool.start()
+
+    @classmethod
+    def stop_servers(cls):
+        if cls.pool is not None:
+            cls.pool.stop()
+            cls.pool = None
+
+    def load(self, fpath:str, parse):
+        # The program, and the circuit's qubit count to size the fully
+        # connected device
+        circ = parse()
+        RebaseQuil().apply(circ)
+        return tk_to_pyquil(circ), circ.n_qubits
+
+    def compile_batch(self, inputs:list):
+        # The requests of a batch are pipelined across the servers
+        if len(inputs) == 1:
+            return super().compile_batch(inputs)
+        with ThreadPoolExecutor(max_workers=len(self.pool.instances)) as executor:
+            return list(executor.map(lambda source: self._attempt(self.compile_one, source), inputs))
+
+    def compile_one(self, source):
+        p_circ, n_qubits = source
+        # Only the fully connected device depends on the circuit
+        if self.backend != devices.BACKEND_FULL:
+            n_qubits = None
+        device_key = (self.backend, n_qubits)
+        make_device = lambda: devices.quilc_device(self.backend, n_qubits)
+        for _ in range(self.warmup):
+            self.pool.quil_to_native_quil(p_circ, device_key, make_device)
+        results = list()
+        samples = list()
+        for _ in range(self.repeat):
+            compiled_pr, sample = self.pool.quil_to_native_quil(p_circ, device_key, make_device)
+            results.append(compiled_pr)
+            samples.append(sample)
+        return Compiled(results, samples, [self.elapsed(sample) for sample in samples], list())
+
+    def to_tket(self, compiled):
+        return pyquil_to_tk(compiled)
+
+
+adapters = {adapter.name : adapter for adapter in (TketAdapter, QiskitAdapter, QuilcAdapter)}
@@ -0,0 +1,101 @@
+# Device registry for bench.py.
+#
+# Each device is only built the first time it is asked for, and is then
+# reused for the rest of the process, so a run only pays for the devices
+# of the backend it targets. Devices are kept separately for each
+# compiler: the tket `Device`, the qiskit `CouplingMap` and the pyquil
+# ISA device.
+
+from functools import lru_cache
+
+BACKEND_FULL = "full"
+BACKEND_GOOGLE = "google"
+BACKEND_IBM = "ibm"
+BACKEND_RIGETTI = "rigetti"
+
+all_to_all_coupling = list()
+for i in range(53):
+    for j in range(i+1,53):
+        all_to_all_coupling.append([i,j])
+
+rigetti_coupling = [[0, 1], [1,2], [2,3], [3, 4], [4, 5], [5, 6], [6, 7], [7, 0],
+                    [8, 9], [9, 10], [10, 11], [11, 12], [12, 13], [13, 14], [14, 15], [15, 8],
+                    [2, 15], [3, 14]]
+
+google_coupling = [[0, 5], [1, 5], [1, 6], [2, 6], [2, 7], [3, 8], [3, 9], [4, 9], [4,
+                    10], [5, 11], [5, 12], [6, 12], [6, 13], [7, 13], [7, 14], [8, 14],
+                    [8, 15], [9, 15], [9, 16], [10, 16], [11, 17], [12, 17], [12, 18],
+                    [13, 18], [13, 19], [14, 19], [14, 20], [15, 20], [15, 21], [16, 21],
+                    [16, 22], [17, 23], [17, 24], [18, 24], [18, 25], [19, 25], [19, 26],
+                    [20, 26], [20, 27], [21, 27], [21, 28], [22, 28], [23, 29], [24, 29],
+                    [24, 30], [25, 30], [25, 31], [26, 31], [26, 32], [27, 32], [27, 33],
+                    [28, 33], [28, 34], [29, 35], [29, 36], [30, 36], [30, 37], [31, 37],
+                    [31, 38], [32, 38], [32, 39], [33, 39], [33, 40], [34, 40], [35, 41],
+                    [36, 41], [36, 42], [37, 42], [37, 43], [38, 43], [38, 44], [39, 44],
+                    [39, 45], [40, 45], [40, 46], [41, 47], [41, 48], [42, 48], [42, 49],
+                    [43, 49], [43, 50], [44, 50], [44, 51], [45, 51], [45, 52], [46, 52],
+                    [47, 53], [48, 53], [48, 54], [49, 54], [49, 55], [50, 55], [50, 56],
+                    [51, 56], [51, 57], [52, 57], [52, 58]]
+
+ibm_coupling = [[0, 5],[0, 1],[1, 2],[1, 0],[2, 3],[2,
+            1],[3, 4], [3, 2], [4, 6], [4, 3], [5, 9], [5, 0], [6,
+            13], [6, 4], [7, 16], [7, 8], [8, 9], [8, 7], [9, 10], [9,
+            8], [9, 5], [10, 11], [10, 9], [11, 17], [11, 12], [11,
+            10], [12, 13], [12, 11], [13, 14], [13, 12], [13, 6], [14,
+            15], [14, 13], [15, 18], [15, 14], [16, 19], [16, 7], [17,
+            23], [17, 11], [18, 27], [18, 15], [19, 20], [19, 16],
+            [20, 21], [20, 19], [21, 28], [21, 22], [21, 20], [22,
+            23], [22, 21], [23, 24], [23, 22], [23, 17], [24, 25],
+            [24, 23], [25, 29], [25, 26], [25, 24], [26, 27], [26,
+            25], [27, 26], [27, 18], [28, 32], [28, 21], [29, 36],
+            [29, 25], [30, 39], [30, 31], [31, 32], [31, 30], [32,
+            33], [32, 31], [32, 28], [33, 34], [33, 32], [34, 40],
+            [34, 35], [34, 33], [35, 36], [35, 34], [36, 37], [36,
+            35], [36, 29], [37, 38], [37, 36], [38, 41], [38, 37],
+            [39, 42], [39, 30], [40, 46], [40, 34], [41, 50], [41,
+            38], [42, 43], [42, 39], [43, 44], [43, 42], [44, 51],
+            [44, 45], [44, 43], [45, 46], [45, 44], [46, 47], [46,
+            45], [46, 40], [47, 48], [47, 46], [48, 52], [48, 49],
+            [48, 47], [49, 50], [49, 48], [50, 49], [50, 41], [51,
+            44], [52, 48]]
+
+couplings = {
+    BACKEND_FULL : all_to_all_coupling,
+    BACKEND_GOOGLE : google_coupling,
+    BACKEND_IBM : ibm_coupling,
+    BACKEND_RIGETTI : rigetti_coupling
+}
+
+@lru_cache(maxsize=None)
+def tket_device(backend:str):
+    from pytket.device import Device
+    from pytket.routing import Architecture
+    return Device(Architecture(couplings[backend]))
+
+@lru_cache(maxsize=None)
+def qiskit_coupling_map(backend:str):
+    # Qiskit is given no coupling map for full connectivity. The map keeps
+    # its own distance matrix once computed, so sharing it across circuits
+    # also saves that work.
+    if backend == BACKEND_FULL:
+        return None
+    from qiskit.transpiler import CouplingMap
+    return CouplingMap(couplings[backend])
+
+@lru_cache(maxsize=None)
+def quilc_device(backend:str, n_qubits:int=None):
+    # The fully connected quilc device is sized to the circuit
+    import networkx as nx
+    from pyquil.device import isa_from_graph, Device as Device_
+    if backend == BACKEND_FULL:
+        devgraph = nx.complete_graph(n_qubits)
+    else:
+        devgraph = nx.from_edgelist(couplings[backend])
+    if backend in (BACKEND_IBM, BACKEND_GOOGLE):
+        twoq_type = ['CZ']
+    else:
+        twoq_type = ['CZ', 'XY']
+    isa = isa_from_graph(devgraph, twoq_type=twoq_type)
+    device = Device_("dev", {"isa" : isa.to_dict()})
+    device._isa = isa
+    return device
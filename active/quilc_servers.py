@@ -0,0 +1,230 @@
+# Management of the quilc (and qvm) servers used to benchmark Quilc.
+#
+# A pool of quilc servers is started on consecutive ports so that several
+# circuits can be compiled at once. Servers are polled until they answer
+# instead of waiting a fixed time after launch. Each server keeps one
+# `QVMCompiler` per device, so the ISA is only sent over once. A server
+# that stops answering within the compile timeout is restarted before it
+# is handed out again.
+#
+# Servers are normally docker containers, but any local command can stand
+# in for them (e.g. `python quilc_stub.py {port}`), which is how the pool
+# is exercised without docker. Launchers also report the CPU time used by
+# a server, so that the time quilc spends compiling can be measured
+# alongside the wall time of the request.
+
+import json, math, os, queue, shlex, subprocess, time, urllib.request
+from contextlib import contextmanager
+
+from measure import measure_once
+
+QVM_IMAGE = "rigetti/qvm"
+QUILC_IMAGE = "rigetti/quilc:1.16.3"
+
+_HOST = "127.0.0.1"
+_QVM_PORT = 5000
+_QUILC_BASE_PORT = 5555
+_READY_TIMEOUT = 60
+_POLL_INTERVAL = 0.2
+_COMPILE_TIMEOUT = 600
+
+
+class DockerLauncher:
+    def __init__(self, image:str, command:str, container_port:int):
+        import docker
+        self.dock = docker.from_env()
+        self.image = image
+        self.command = command
+        self.container_port = container_port
+        # The cgroup file holding each container's CPU usage, by container
+        # id, or None where it can't be read
+        self.usage_files = dict()
+
+    def start(self, port:int):
+        return self.dock.containers.run(image=self.image, command=self.command, detach=True, ports={self.container_port:port}, remove=True)
+
+    def stop(self, handle):
+        handle.stop()
+
+    def cpu_time(self, handle):
+        # Read from the container's cgroup where the daemon is local, which
+        # costs no more than reading /proc. Otherwise the daemon's one-shot
+        # stats are used: plain stats block for a second or two while the
+        # daemon takes a second sample, so without one-shot support the
+        # CPU time is not collected.
+        if handle.id not in self.usage_files:
+            self.usage_files[handle.id] = _cgroup_usage_file(handle)
+        usage_file = self.usage_files[handle.id]
+        if usage_file is not None:
+            with open(usage_file) as f:
+                if usage_file.endswith("cpu.stat"):
+                    usage = dict(line.split() for line in f)
+                    return int(usage["usage_usec"]) / 1e6
+                return int(f.read()) / 1e9
+        try:
+            stats = handle.stats(stream=False, one_shot=True)
+        except TypeError: # docker-py without one-shot stats
+            return math.nan
+        return stats["cpu_stats"]["cpu_usage"]["total_usage"] / 1e9
+
+
+def _cgroup_usage_file(handle):
+    # The cgroup file with the CPU usage of a container, found through the
+    # cgroup of its main process: cpu.stat (in microseconds) under cgroup
+    # v2, or cpuacct.usage (in nanoseconds) under v1
+    try:
+        handle.reload()
+        with open("/proc/{}/cgroup".format(handle.attrs["State"]["Pid"])) as f:
+            lines = f.read().splitlines()
+    except (OSError, KeyError):
+        return None
+    for line in lines:
+        hierarchy, controllers, path = line.split(":", 2)
+        if hierarchy == "0":
+            candidates = [os.path.join("/sys/fs/cgroup", path.lstrip("/"), "cpu.stat")]
+        elif "cpuacct" in controllers.split(","):
+            candidates = [os.path.join("/sys/fs/cgroup", mount, path.lstrip("/"), "cpuacct.usage") for mount in (controllers, "cpuacct")]
+        else:
+            continue
+        for candidate in candidates:
+            if os.path.exists(candidate):
+                return candidate
+    return None
+
+
+class CommandLauncher:
+    # `command` is formatted with the port to listen on
+    def __init__(self, command:str):
+        self.command = command
+
+    def start(self, port:int):
+        return subprocess.Popen(shlex.split(self.command.format(port=port)))
+
+    def stop(self, handle):
+        handle.terminate()
+        try:
+            handle.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            handle.kill()
+            handle.wait()
+
+    def cpu_time(self, handle):
+        # Only available where /proc is
+        try:
+            with open("/proc/{}/stat".format(handle.pid)) as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+        except OSError:
+            return math.nan
+        return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+def wait_for_quilc(port:int, timeout:float=_READY_TIMEOUT):
+    from rpcq import Client
+    deadline = time.time() + timeout
+    while True:
+        client = Client("tcp://{}:{}".format(_HOST, port), timeout=_POLL_INTERVAL * 5)
+        try:
+            return client.call("get_version_info")
+        except TimeoutError:
+            if time.time() > deadline:
+                raise TimeoutError("quilc server on port {} did not start".format(port))
+        finally:
+            client.close()
+
+
+def wait_for_qvm(port:int, timeout:float=_READY_TIMEOUT):
+    deadline = time.time() + timeout
+    request = json.dumps({"type" : "version"}).encode()
+    while True:
+        try:
+            with urllib.request.urlopen("http://{}:{}".format(_HOST, port), data=request, timeout=_POLL_INTERVAL * 5) as response:
+                return response.read().decode()
+        except OSError:
+            if time.time() > deadline:
+                raise TimeoutError("qvm server on port {} did not start".format(port))
+            time.sleep(_POLL_INTERVAL)
+
+
+class QuilcInstance:
+    def __init__(self, port:int):
+        self.port = port
+        self.handle = None
+        self.compilers = dict()
+
+    @property
+    def endpoint(self):
+        return "tcp://{}:{}".format(_HOST, self.port)
+
+
+class QuilcServerPool:
+    def __init__(self, n_servers:int=1, launcher=None, qvm_launcher=None, base_port:int=_QUILC_BASE_PORT, compile_timeout:float=_COMPILE_TIMEOUT):
+        if launcher is None:
+            launcher = DockerLauncher(QUILC_IMAGE, "-R", _QUILC_BASE_PORT)
+        self.launcher = launcher
+        self.qvm_launcher = qvm_launcher
+        self.qvm_handle = None
+        self.compile_timeout = compile_timeout
+        self.instances = [QuilcInstance(base_port + i) for i in range(n_servers)]
+        self._idle = queue.Queue()
+
+    def start(self):
+        if self.qvm_launcher is not None:
+            self.qvm_handle = self.qvm_launcher.start(_QVM_PORT)
+        for inst in self.instances:
+            inst.handle = self.launcher.start(inst.port)
+        if self.qvm_launcher is not None:
+            wait_for_qvm(_QVM_PORT)
+        for inst in self.instances:
+            wait_for_quilc(inst.port)
+            self._idle.put(inst)
+        return self
+
+    def stop(self):
+        for inst in self.instances:
+            if inst.handle is not None:
+                self.launcher.stop(inst.handle)
+                inst.handle = None
+        if self.qvm_handle is not None:
+            self.qvm_launcher.stop(self.qvm_handle)
+            self.qvm_handle = None
+
+    def restart(self, inst:QuilcInstance):
+        print("restarting quilc server on port {}".format(inst.port))
+        self.launcher.stop(inst.handle)
+        inst.compilers.clear()
+        inst.handle = self.launcher.start(inst.port)
+        wait_for_quilc(inst.port)
+
+    @contextmanager
+    def instance(self):
+        inst = self._idle.get()
+        try:
+            yield inst
+        finally:
+            self._idle.put(inst)
+
+    def compiler(self, inst:QuilcInstance, device_key, make_device):
+        # One QVMCompiler per (server, device); `make_device` builds the
+        # pyquil device the first time it is needed
+        if device_key not in inst.compilers:
+            from pyquil.api import QVMCompiler
+            inst.compilers[device_key] = QVMCompiler(inst.endpoint, make_device(), timeout=self.compile_timeout)
+        return inst.compilers[device_key]
+
+    def quil_to_native_quil(self, program, device_key, make_device):
+        # Returns the compiled program and the measurement of the request,
+        # including the CPU time used by the server
+        with self.instance() as inst:
+            qcompiler = self.compiler(inst, device_key, make_device)
+            try:
+                return measure_once(qcompiler.quil_to_native_quil, (program,), lambda: self.launcher.cpu_time(inst.handle))
+            except TimeoutError:
+                self.restart(inst)
+                raise
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+        return False
@@ -0,0 +1,28 @@
+# Minimal stand-in for a quilc server, for exercising bench.py's quilc
+# server pool without docker. It answers on the same rpcq interface as
+# `quilc -R`, but returns every program unchanged.
+#
+# usage: quilc_stub.py <port> [<delay>]
+# <delay> = seconds to wait before answering each compile request, to
+# simulate a slow or hung server
+
+import asyncio, sys
+
+from rpcq import Server
+from rpcq.messages import NativeQuilRequest, NativeQuilResponse, NativeQuilMetadata
+
+port = int(sys.argv[1])
+delay = float(sys.argv[2]) if len(sys.argv) > 2 else 0.0
+
+server = Server()
+
+@server.rpc_handler
+def get_version_info():
+    return {"quilc" : "1.16.3", "githash" : "stub"}
+
+@server.rpc_handler
+async def quil_to_native_quil(request:NativeQuilRequest, protoquil=None):
+    await asyncio.sleep(delay)
+    return NativeQuilResponse(quil=request.quil, metadata=NativeQuilMetadata())
+
+server.run(endpoint="tcp://127.0.0.1:{}".format(port))
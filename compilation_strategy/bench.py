@@ -8,12 +8,25 @@
 # symbolic. This does not affect the compilation metrics, as the
 # angles are not Clifford regardless.
 
+# Every operator is first sequenced into a circuit of Pauli exponentials
+# with `gen_term_sequence_circuit`, and that circuit is then compiled with
+# each strategy. The sequencing and each strategy are separate jobs,
+# started largest molecule first and run across -j worker processes (see
+# utils/job_graph.py). A sequenced circuit is handed to its strategy jobs
+# in serialised form, so it is only computed once per operator.
+#
+# The wall time, CPU time and peak memory of every stage (sequencing and
+# each strategy) are written to results/{enc}_results_Stages.csv, which
+# plot_timing.py fits against the number of active spin orbitals.
+
 
 import os
+import sys
+import functools
+import getopt
 import pickle
 import json
 import pandas as pd
-import datetime
 
 from pytket.circuit import Qubit, Circuit, OpType, fresh_symbol, PauliExpBox
 from pytket.utils import gen_term_sequence_circuit
@@ -21,8 +34,19 @@ from pytket.utils import QubitPauliOperator
 from pytket.transform import Transform, PauliSynthStrat, CXConfigType
 from pytket.pauli import Pauli
 
-with open("orbital_lut.txt") as json_file:
-    orbitals_lookup_table = json.load(json_file)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "utils"))
+from result_sink import ResultWriter
+from measure import measure_once
+from circuit_metrics import circuit_metrics
+from job_graph import Job, run_jobs
+from operator_store import open_store, pickle_paths
+
+
+def usage():
+    print("usage: {source} [-j <workers>]".format(source=sys.argv[0]))
+
+
+encodings = ("BK", "JW", "P")
 
 cols = [
     "Circuit Name",
@@ -36,83 +60,171 @@ cols = [
     "Set Compile Time",
 ]
 
-for encoding_name in ("BK", "JW", "P"):
-    op_directory = "operators/{}_operators".format(encoding_name)
-    results_file = "results/{}_results.csv".format(encoding_name)
-    stat_table = pd.DataFrame({})
-    for filename in os.listdir(op_directory):
-        path = op_directory + "/" + filename
-        with open(path, "rb") as pickle_in:
-            qubit_pauli_operator = pickle.load(pickle_in)
-        name = filename.replace(".pickle", "")
-        print(name)
-        active_spin_orbitals = orbitals_lookup_table[name]
-
-        # Qiskit removed 2 qubits per circuit for us using Z2
-        # Symmetries for the Parity encoding
-        if encoding_name == "P":
-            n_qubits = active_spin_orbitals - 2
-        else:
-            n_qubits = active_spin_orbitals
-
-        initial_circ = Circuit(n_qubits)
-
-        print("sequencing")
-        t1_a = datetime.datetime.now()
-        set_synth_circuit = gen_term_sequence_circuit(
-            qubit_pauli_operator, initial_circ
-        )
-        t1_b = datetime.datetime.now()
-        print(
-            "Partitions: {}".format(set_synth_circuit.n_gates_of_type(OpType.CircBox))
-        )
-
-        naive_circuit = set_synth_circuit.copy()
-        pairwise_circuit = set_synth_circuit.copy()
-
-        Transform.DecomposeBoxes().apply(naive_circuit)
-        # Naive construction: decompose each Pauli exponential invidually
-        naive_cx_count = naive_circuit.n_gates_of_type(OpType.CX)
-        naive_cx_depth = naive_circuit.depth_by_type(OpType.CX)
+stage_cols = [
+    "Circuit Name",
+    "Active Spin Orbitals",
+    "Stage",
+    "Wall time",
+    "CPU time",
+    "Peak RSS (MiB)",
+]
 
-        print("pairwise synth")
+STAGE_SEQUENCING = "Sequencing"
+STRATEGY_NAIVE = "Naive"
+STRATEGY_PAIRWISE = "Pairwise"
+STRATEGY_SET = "Set"
+# Most expensive first, so that a molecule's set synthesis starts before
+# its cheaper strategies
+strategies = (STRATEGY_SET, STRATEGY_PAIRWISE, STRATEGY_NAIVE)
+
+
+# Operators are read from the store built by operator_store.py where it
+# has an up-to-date copy, and unpickled otherwise
+operator_store = functools.lru_cache(maxsize=None)(open_store)
+
+
+def stored(op_directory:str, name:str):
+    # Whether the store holds the operator as it is in its pickle, or
+    # holds it at all when the pickle is gone
+    store = operator_store(op_directory)
+    if store is None or name not in store:
+        return False
+    fpath = op_directory + "/" + name + ".pickle"
+    return not os.path.exists(fpath) or store.is_current(name, fpath)
+
+
+def load_operator(op_directory:str, name:str):
+    if stored(op_directory, name):
+        return operator_store(op_directory).operator(name)
+    with open(op_directory + "/" + name + ".pickle", "rb") as pickle_in:
+        return pickle.load(pickle_in)
+
+
+def operator_sizes(op_directory:str):
+    # Every operator in the store or the pickles, with its number of terms
+    # or, where the store has no up-to-date copy, its pickle size as an
+    # estimate of how long it takes to compile. Pickle sizes are far
+    # larger than term counts, so new and changed operators are scheduled
+    # first.
+    store = operator_store(op_directory)
+    names = set(pickle_paths(op_directory)) | set(store.names() if store is not None else ())
+    return {
+        name : store.n_terms(name) if stored(op_directory, name) else os.path.getsize(op_directory + "/" + name + ".pickle")
+        for name in sorted(names)
+    }
+
+
+def sequence_operator(op_directory:str, name:str, n_qubits:int):
+    # Returns the serialised sequenced circuit, the number of partitions
+    # and the measurement of the sequencing
+    qubit_pauli_operator = load_operator(op_directory, name)
+    initial_circ = Circuit(n_qubits)
+    circ, sample = measure_once(gen_term_sequence_circuit, (qubit_pauli_operator, initial_circ))
+    return circ.to_dict(), circ.n_gates_of_type(OpType.CircBox), sample
+
+
+def apply_strategy(strategy:str, circ:Circuit):
+    if strategy == STRATEGY_NAIVE:
+        # Naive construction: decompose each Pauli exponential invidually
+        Transform.DecomposeBoxes().apply(circ)
+    elif strategy == STRATEGY_PAIRWISE:
         # Pairwise construction: decompose each Pauli exponential
         # two-by-two, using balanced trees of CX gates.
-        Transform.UCCSynthesis(
-            PauliSynthStrat.Pairwise, CXConfigType.Tree
-        ).apply(pairwise_circuit)
-        pairwise_cx_count = pairwise_circuit.n_gates_of_type(OpType.CX)
-        pairwise_cx_depth = pairwise_circuit.depth_by_type(OpType.CX)
-
-        print("set synth")
-        t1_c = datetime.datetime.now()
+        Transform.UCCSynthesis(PauliSynthStrat.Pairwise, CXConfigType.Tree).apply(circ)
+    else:
         # Full set-based synthesis: diagonalise each commuting set, then
         # synthesise with phase polynomials.
-        Transform.UCCSynthesis(PauliSynthStrat.Sets, CXConfigType.Tree).apply(
-            set_synth_circuit
-        )
-        t1_d = datetime.datetime.now()
-        set_synth_cx_count = set_synth_circuit.n_gates_of_type(OpType.CX)
-        set_synth_cx_depth = set_synth_circuit.depth_by_type(OpType.CX)
-
-        set_compile_time = (t1_b - t1_a + t1_d - t1_c).total_seconds()
-        print("Time for set-based: {}".format(set_compile_time))
-
-        results = [
-            [
-                name,
-                active_spin_orbitals,
-                naive_cx_count,
-                naive_cx_depth,
-                pairwise_cx_count,
-                pairwise_cx_depth,
-                set_synth_cx_count,
-                set_synth_cx_depth,
-                set_compile_time,
+        Transform.UCCSynthesis(PauliSynthStrat.Sets, CXConfigType.Tree).apply(circ)
+
+
+def synthesise(strategy:str, circ_dict:dict):
+    # Returns the CX count and depth of the synthesised circuit, and the
+    # measurement of the synthesis
+    circ = Circuit.from_dict(circ_dict)
+    _, sample = measure_once(apply_strategy, (strategy, circ))
+    m = circuit_metrics(circ, {OpType.CX})
+    return m.n_2qb_gates, m.depth_2qb, sample
+
+
+if __name__ == "__main__":
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "j:")
+    except getopt.GetoptError as err:
+        print(err)
+        usage()
+        exit()
+
+    n_workers = 1
+    for o, v in opts:
+        if o == "-j":
+            if not v.isdigit() or int(v) < 1:
+                print("invalid number of workers: " + v)
+                usage()
+                exit()
+            n_workers = int(v)
+
+    with open("orbital_lut.txt") as json_file:
+        orbitals_lookup_table = json.load(json_file)
+
+    writers = dict()
+    stage_writers = dict()
+    operators = dict()
+    jobs = list()
+    for encoding_name in encodings:
+        op_directory = "operators/{}_operators".format(encoding_name)
+        results_file = "results/{}_results.csv".format(encoding_name)
+        writers[encoding_name] = ResultWriter(results_file, cols)
+        stage_file = os.path.splitext(results_file)[0] + "_Stages.csv"
+        stage_writers[encoding_name] = ResultWriter(stage_file, stage_cols)
+        for name, size in operator_sizes(op_directory).items():
+            active_spin_orbitals = orbitals_lookup_table[name]
+
+            # Qiskit removed 2 qubits per circuit for us using Z2
+            # Symmetries for the Parity encoding
+            if encoding_name == "P":
+                n_qubits = active_spin_orbitals - 2
+            else:
+                n_qubits = active_spin_orbitals
+
+            # Larger molecules first, by active spin orbitals and then by
+            # the size of the operator
+            priority = (active_spin_orbitals, size)
+            operators[name] = {"encoding" : encoding_name, "orbitals" : active_spin_orbitals, "priority" : priority}
+            jobs.append(Job(priority + (len(strategies),), (name, None), sequence_operator, (op_directory, name, n_qubits)))
+
+    def write_stage(name, stage, sample):
+        op = operators[name]
+        row = [name, op["orbitals"], stage, sample.wall, sample.cpu, sample.peak_rss]
+        stage_writers[op["encoding"]].write(row)
+
+    def done(tag, result):
+        name, strategy = tag
+        op = operators[name]
+        if strategy is None:
+            circ_dict, partitions, op[STAGE_SEQUENCING] = result
+            write_stage(name, STAGE_SEQUENCING, op[STAGE_SEQUENCING])
+            print("{}: sequenced, {} partitions".format(name, partitions))
+            return [
+                Job(op["priority"] + (len(strategies) - 1 - i,), (name, s), synthesise, (s, circ_dict))
+                for i, s in enumerate(strategies)
             ]
-        ]
-        new_table_row = pd.DataFrame(results, columns=cols)
-        print(new_table_row)
-        stat_table = stat_table.append(new_table_row)
-        stat_table = stat_table.sort_values(by=['Active Spin Orbitals', 'Circuit Name'])
-        stat_table.to_csv(results_file, index=False)
+        op[strategy] = result
+        write_stage(name, strategy, result[2])
+        print("{}: {} synthesis done in {:.2f}s".format(name, strategy.lower(), result[2].wall))
+        if all(s in op for s in strategies):
+            set_compile_time = op[STAGE_SEQUENCING].wall + op[STRATEGY_SET][2].wall
+            print("{}: time for set-based: {}".format(name, set_compile_time))
+            row = [name, op["orbitals"]]
+            for s in (STRATEGY_NAIVE, STRATEGY_PAIRWISE, STRATEGY_SET):
+                row += list(op[s][:2])
+            row.append(set_compile_time)
+            print(pd.DataFrame([row], columns=cols))
+            writers[op["encoding"]].write(row)
+            del operators[name]
+        return None
+
+    run_jobs(jobs, done, n_workers)
+
+    for encoding_name in encodings:
+        writers[encoding_name].finalise(sort_by=['Active Spin Orbitals', 'Circuit Name'])
+        stage_writers[encoding_name].finalise(sort_by=['Active Spin Orbitals', 'Circuit Name', 'Stage'])
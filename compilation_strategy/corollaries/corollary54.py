@@ -1,12 +1,30 @@
+import functools
+import getopt
 import itertools
+import sys
+import time
+
+import pauli_sets
+import shards
 
 # All length 3 lists of Paulis. Each list corresponds to a single
 # qubit to be diagonalised over 3 gadgets.
 qubits = list(itertools.product(["I", "X", "Y", "Z"], repeat=3))
 
-# All pairs of length 3 lists of Paulis. Each pair corresponds to a
-# pair of qubits.
-qubit_pairs = list(itertools.product(qubits, repeat=2))
+# All pairs of length 3 lists of Paulis are checked. Each pair
+# corresponds to a pair of qubits. The pairs are split into shards by
+# their first qubit and run across -j worker processes. With -c they are
+# checkpointed as they complete (see shards.py).
+#
+# By default each pair is looked up in the compatibility tables of
+# pauli_sets.py, which are indexed in the same order as `qubits`; -r runs
+# solved() and solvable() below on every pair instead.
+
+
+def usage():
+    print("usage: {source} [-r] [-j <workers>] [-s <shards>] [-c <checkpoint>]".format(source=sys.argv[0]))
+    print("<shards> = number of shards, one per qubit (default)")
+    print("<checkpoint> = checkpoint file to record completed shards in and resume from, none (default)")
 
 # If a list of Paulis has only a single non-I Pauli type, the
 # corresponding qubit is trivially diagonalisable using single-qubit
@@ -35,9 +53,67 @@ def solvable(q, r):
     return False
 
 
-for q1, q2 in qubit_pairs:
-    if not solved(q1) and not solved(q2) and not solvable(q1, q2):
-        print("Incompatible combination found: {}, {}".format(q1, q2))
+def reference_check(start, stop):
+    checked = 0
+    for q1 in qubits[start:stop]:
+        if shards.stop_requested():
+            break
+        for q2 in qubits:
+            checked += 1
+            if not solved(q1) and not solved(q2) and not solvable(q1, q2):
+                return (q1, q2), checked
+    return None, checked
+
+
+def check_shard(reference, shard):
+    start, stop = shard
+    if reference:
+        return reference_check(start, stop)
+    compatible = pauli_sets.column_tables(3).compatible
+    checked = 0
+    for i in range(start, stop):
+        row = compatible[i]
+        if not row.all():
+            j = int(row.argmin())
+            return (qubits[i], qubits[j]), checked + j + 1
+        checked += len(row)
+    return None, checked
+
+
+if __name__ == "__main__":
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "rj:s:c:")
+    except getopt.GetoptError as err:
+        print(err)
+        usage()
+        exit()
+
+    reference = False
+    n_workers = 1
+    n_shards = len(qubits)
+    checkpoint = None
+    for o, v in opts:
+        if o in ("-j", "-s"):
+            if not v.isdigit() or int(v) < 1:
+                print("invalid {o}: {v}".format(o=o, v=v))
+                usage()
+                exit()
+            if o == "-j":
+                n_workers = int(v)
+            else:
+                n_shards = int(v)
+        elif o == "-r":
+            reference = True
+        elif o == "-c":
+            checkpoint = v
+
+    start = time.time()
+    check = {"script" : "corollary54", "reference" : reference}
+    pair, checked = shards.run_shards(functools.partial(check_shard, reference), shards.index_shards(len(qubits), n_shards), n_workers, checkpoint, check)
+    print("Qubit pairs checked: {}".format(checked))
+    print("Time: {:.1f}s".format(time.time() - start))
+    if pair is not None:
+        print("Incompatible combination found: {}, {}".format(*pair))
         exit()
 
-print("All combinations compatible.")
+    print("All combinations compatible.")
@@ -1,16 +1,32 @@
+import functools
+import getopt
 import itertools
+import math
+import sys
+import time
 
-# All length 4 lists of Paulis. Each list corresponds to a 4-qubit
-# Pauli string.
-strings = list(itertools.product(["I", "X", "Y", "Z"], repeat=4))
+import numpy as np
 
-# Each commuting set of Pauli gadgets is generated by at most 4
-# strings, so it is sufficient to test over all combinations of 4
-# strings.
-string_sets = list(itertools.combinations(strings, 4))
+import pauli_sets
+import shards
 
-print(len(strings))
-print(len(string_sets))
+# Each commuting set of Pauli gadgets on 4 qubits is generated by at most
+# 4 strings, so it is sufficient to test over all combinations of 4
+# strings. Other numbers of qubits (-n) and strings per set (-k) can be
+# checked too. By default the check runs on the vectorised engine in
+# pauli_sets.py; -r runs the pure-Python reference implementation below
+# instead, which is only practical for small parameters.
+#
+# The sets are split into shards by the index of their first string, run
+# across -j worker processes. With -c they are checkpointed as they
+# complete (see shards.py), so an interrupted check picks up where it
+# stopped.
+
+
+def usage():
+    print("usage: {source} [-n <qubits>] [-k <strings>] [-r] [-j <workers>] [-s <shards>] [-c <checkpoint>]".format(source=sys.argv[0]))
+    print("<shards> = number of shards, one per Pauli string (default)")
+    print("<checkpoint> = checkpoint file to record completed shards in and resume from, none (default)")
 
 # If a list of Paulis has only a single non-I Pauli type, the
 # corresponding qubit is trivially diagonalisable using single-qubit
@@ -65,14 +81,85 @@ def commuting_set(s):
     return True
 
 
-for i, ss in enumerate(string_sets):
-    # Progress check
-    if i % 1000000 == 0:
-        print(i)
-    if not commuting_set(ss):
-        continue
-    if not any_solvable(ss):
+def reference_check(n, k, firsts):
+    # All length n lists of Paulis. Each list corresponds to an n-qubit
+    # Pauli string.
+    strings = list(itertools.product(["I", "X", "Y", "Z"], repeat=n))
+    checked = 0
+    for i in firsts:
+        if shards.stop_requested():
+            break
+        for rest in itertools.combinations(strings[i + 1:], k - 1):
+            ss = (strings[i],) + rest
+            checked += 1
+            if not commuting_set(ss):
+                continue
+            if not any_solvable(ss):
+                return ss, checked
+    return None, checked
+
+
+def check_shard(n, k, reference, shard):
+    start, stop = shard
+    if reference:
+        return reference_check(n, k, range(start, stop))
+    return pauli_sets.find_incompatible(n, k, np.arange(start, stop), stop=shards.stop_requested)
+
+
+if __name__ == "__main__":
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "n:k:rj:s:c:")
+    except getopt.GetoptError as err:
+        print(err)
+        usage()
+        exit()
+
+    n = 4
+    k = 4
+    reference = False
+    n_workers = 1
+    n_shards = None
+    checkpoint = None
+    for o, v in opts:
+        if o in ("-n", "-k", "-j", "-s"):
+            if not v.isdigit() or int(v) < 1:
+                print("invalid {o}: {v}".format(o=o, v=v))
+                usage()
+                exit()
+            if o == "-n":
+                n = int(v)
+            elif o == "-k":
+                k = int(v)
+            elif o == "-j":
+                n_workers = int(v)
+            else:
+                n_shards = int(v)
+        elif o == "-r":
+            reference = True
+        elif o == "-c":
+            checkpoint = v
+
+    if n_shards is None:
+        n_shards = 4 ** n
+
+    print(4 ** n)
+    print(math.comb(4 ** n, k))
+
+    start = time.time()
+    ss, checked = shards.run_shards(
+        functools.partial(check_shard, n, k, reference),
+        shards.index_shards(4 ** n, n_shards),
+        n_workers,
+        checkpoint,
+        {"script" : "corollary55", "n" : n, "k" : k, "reference" : reference},
+    )
+    if reference:
+        print("Combinations checked: {}".format(checked))
+    else:
+        print("Commuting sets checked: {}".format(checked))
+    print("Time: {:.1f}s".format(time.time() - start))
+    if ss is not None:
         print("Incompatible combination found: {}".format(ss))
         exit()
 
-print("All combinations compatible.")
+    print("All combinations compatible.")
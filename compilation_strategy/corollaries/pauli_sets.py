@@ -0,0 +1,187 @@
+# Vectorised engine for the exhaustive commuting-set checks.
+#
+# Pauli strings on n qubits are numbered 0 .. 4^n - 1 in the order of
+# `itertools.product(["I", "X", "Y", "Z"], repeat=n)`, and encoded as
+# (x, z) bitmasks so that commutation reduces to the parity of a
+# symplectic product. All pairwise commutations are precomputed in a
+# 4^n x 4^n table.
+#
+# Commuting sets of k strings are enumerated in increasing index order
+# and extended one string at a time, with the table pruning any string
+# that fails to commute with the set so far. Non-commuting prefixes are
+# therefore never expanded. Sets are produced in batches of index arrays,
+# and the compatibility check of corollary55.py (Theorem 5.2) is applied
+# to a whole batch at once.
+#
+# A qubit of a set is described by its column: the Paulis the k strings
+# act with on it, numbered 0 .. 4^k - 1 in the same order as the strings.
+# Whether a column is solved, and whether two columns are a compatible
+# pair, depend only on the column indices, so both are computed once per
+# k in `column_tables` and the checks become lookups into those tables.
+
+from collections import namedtuple
+import functools, itertools
+import numpy as np
+
+PAULIS = ["I", "X", "Y", "Z"]
+
+# Upper bound on the number of partial sets expanded at once
+_MAX_ROWS = 1 << 16
+
+ColumnTables = namedtuple("ColumnTables", ["solved", "solvable", "compatible"])
+
+
+def pauli_codes(n:int):
+    # Letters (0 = I, 1 = X, 2 = Y, 3 = Z) of each of the 4^n strings on
+    # n qubits, as an array of shape (4^n, n)
+    index = np.arange(4 ** n)
+    powers = 4 ** np.arange(n - 1, -1, -1)
+    return ((index[:, None] // powers) % 4).astype(np.uint8)
+
+
+def _parity(v):
+    # Parity of the number of set bits of each element of a uint64 array
+    for shift in (32, 16, 8, 4, 2, 1):
+        v = v ^ (v >> np.uint64(shift))
+    return (v & np.uint64(1)).astype(bool)
+
+
+def symplectic(codes):
+    # (x, z) bitmasks of each string: X = (1, 0), Y = (1, 1), Z = (0, 1)
+    bits = np.uint64(1) << np.arange(codes.shape[1], dtype=np.uint64)
+    x = (((codes == 1) | (codes == 2)) * bits).sum(axis=1, dtype=np.uint64)
+    z = (((codes == 2) | (codes == 3)) * bits).sum(axis=1, dtype=np.uint64)
+    return x, z
+
+
+@functools.lru_cache(maxsize=None)
+def commutation_table(n:int):
+    # Boolean table of which pairs of n-qubit strings commute. The table
+    # is shared, so it must not be modified.
+    x, z = symplectic(pauli_codes(n))
+    return ~_parity((x[:, None] & z[None, :]) ^ (z[:, None] & x[None, :]))
+
+
+def column_index(q):
+    # Index of a column given as a sequence of Paulis
+    index = 0
+    for p in q:
+        index = 4 * index + PAULIS.index(p)
+    return index
+
+
+@functools.lru_cache(maxsize=None)
+def column_tables(k:int):
+    # Lookup tables over the 4^k columns of length k:
+    #   solved[q]        q has at most one non-I Pauli type (solved in the
+    #                    corollary scripts)
+    #   solvable[q, r]   q and r are a compatible pair, cf Theorem 5.2
+    #                    (solvable in the corollary scripts)
+    #   compatible[q, r] solved[q] or solved[r] or solvable[q, r], i.e. the
+    #                    pair lets a set be diagonalised
+    # The tables are shared, so they are made read-only.
+    columns = pauli_codes(k)
+    present = np.stack([(columns == a).any(axis=1) for a in (1, 2, 3)], axis=1)
+    solved = present.sum(axis=1) <= 1
+    # For each column and Pauli a, the positions holding I or a. Two
+    # columns q and r are a compatible pair if some choice of a and b gives
+    # the same positions for q and for r.
+    bits = 1 << np.arange(k)
+    masks = np.stack([(((columns == 0) | (columns == a)) * bits).sum(axis=1) for a in (1, 2, 3)], axis=1)
+    solvable = np.zeros((len(columns), len(columns)), dtype=bool)
+    for a in range(3):
+        for b in range(3):
+            solvable |= masks[:, a, None] == masks[None, :, b]
+    compatible = solvable | solved[:, None] | solved[None, :]
+    for table in (solved, solvable, compatible):
+        table.flags.writeable = False
+    return ColumnTables(solved, solvable, compatible)
+
+
+def commuting_sets(table, k:int, firsts=None, max_rows:int=_MAX_ROWS):
+    # Yields arrays of shape (B, k) holding every set of k distinct,
+    # pairwise commuting strings, each in increasing index order. Only
+    # sets whose first string is in `firsts` (default: all) are produced.
+    n_strings = len(table)
+    # Only strings with a higher index than the last one may be added
+    later = np.triu(table, 1)
+    if firsts is None:
+        firsts = np.arange(n_strings)
+    firsts = np.asarray(firsts, dtype=np.int32)
+    if k == 1:
+        yield firsts[:, None]
+        return
+    yield from _extend(later, firsts[:, None], later[firsts], k, max_rows)
+
+
+def _extend(later, partial, allowed, k:int, max_rows:int):
+    # `partial` holds sets of m < k strings, and `allowed` the strings that
+    # each of them can be extended with
+    last = partial.shape[1] + 1 == k
+    counts = allowed.sum(axis=1)
+    start = 0
+    while start < len(partial):
+        # Take as many partial sets as keep the expansion under max_rows
+        total = np.cumsum(counts[start:])
+        stop = start + max(1, int(np.searchsorted(total, max_rows, side="right")))
+        rows, cols = np.nonzero(allowed[start:stop])
+        if len(rows) > 0:
+            rows += start
+            extended = np.concatenate([partial[rows], cols[:, None].astype(np.int32)], axis=1)
+            if last:
+                yield extended
+            else:
+                yield from _extend(later, extended, allowed[rows] & later[cols], k, max_rows)
+        start = stop
+
+
+class CompatibilityChecker:
+    # Applies the compatibility check of corollary55.py to batches of sets
+    # of k strings on n qubits
+
+    def __init__(self, n:int, k:int):
+        self.n = n
+        self.k = k
+        self.codes = pauli_codes(n)
+        self.table = column_tables(k).compatible
+        self.weights = 4 ** np.arange(k - 1, -1, -1)
+        self.pairs = np.array(list(itertools.combinations(range(n), 2)), dtype=np.intp).reshape(-1, 2)
+
+    def columns(self, sets):
+        # Column index of every qubit of every set, shape (B, n)
+        return np.tensordot(self.codes[sets], self.weights, axes=([1], [0]))
+
+    def compatible(self, sets):
+        # Whether each set has a solved qubit or a compatible pair of
+        # qubits, as any_solvable in corollary55.py
+        cols = self.columns(sets)
+        return self.table[cols[:, self.pairs[:, 0]], cols[:, self.pairs[:, 1]]].any(axis=1)
+
+
+@functools.lru_cache(maxsize=None)
+def _checker(n:int, k:int):
+    return CompatibilityChecker(n, k)
+
+
+def strings_of(n:int, indices):
+    # The strings with the given indices, as tuples of Paulis
+    codes = pauli_codes(n)
+    return tuple(tuple(PAULIS[c] for c in codes[i]) for i in indices)
+
+
+def find_incompatible(n:int, k:int, firsts=None, max_rows:int=_MAX_ROWS, stop=None):
+    # Checks every commuting set of k strings on n qubits (restricted to
+    # first strings in `firsts`). Returns the first incompatible set found,
+    # or None, and the number of commuting sets checked. `stop` is polled
+    # between batches, and the check gives up once it returns True.
+    table = commutation_table(n)
+    checker = _checker(n, k)
+    checked = 0
+    for sets in commuting_sets(table, k, firsts, max_rows):
+        if stop is not None and stop():
+            break
+        ok = checker.compatible(sets)
+        checked += len(sets)
+        if not ok.all():
+            return strings_of(n, sets[np.argmin(ok)]), checked
+    return None, checked
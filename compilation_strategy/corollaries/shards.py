@@ -0,0 +1,136 @@
+# Sharded, resumable execution of the exhaustive corollary checks.
+#
+# The search space of a check is split into shards: ranges [start, stop)
+# of the index of its first element. Shards run one at a time or across a
+# pool of worker processes. If a checkpoint file is given, each shard is
+# appended to it as it completes, so that an interrupted check resumes
+# with the shards that are still missing. Entries record which check
+# produced them (its script and parameters) and the number of shards the
+# space was split into, and only those of the same check and split are
+# resumed. The first counterexample found is checkpointed too, and stops
+# every worker.
+#
+# A check is a function taking a shard and returning the counterexample
+# found in it (or None) and the number of combinations it checked.
+# Long-running checks should poll `stop_requested` and return early once
+# it is set.
+
+import json, multiprocessing, os, time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+_stop_event = None
+
+
+def _init_worker(event):
+    global _stop_event
+    _stop_event = event
+
+
+def stop_requested():
+    return _stop_event is not None and _stop_event.is_set()
+
+
+def index_shards(n_items:int, n_shards:int):
+    # Splits range(n_items) into at most n_shards contiguous ranges
+    n_shards = max(1, min(n_shards, n_items))
+    bounds = [n_items * i // n_shards for i in range(n_shards + 1)]
+    return [(bounds[i], bounds[i + 1]) for i in range(n_shards)]
+
+
+def _as_tuples(value):
+    # JSON turns the tuples of a counterexample into lists
+    if isinstance(value, list):
+        return tuple(_as_tuples(v) for v in value)
+    return value
+
+
+def _load_checkpoint(path:str, check:dict, n_shards:int):
+    # Shards of the same check completed with the same number of shards,
+    # and any counterexample of the same check, which holds whatever the
+    # split
+    done = dict()
+    counterexample = None
+    other_checks = 0
+    other_splits = 0
+    if path is None or not os.path.exists(path):
+        return done, counterexample
+    with open(path) as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue # A line cut short by an interruption
+            if entry.get("check") != check:
+                other_checks += 1
+            elif "counterexample" in entry:
+                counterexample = _as_tuples(entry["counterexample"])
+            elif entry.get("n_shards") == n_shards:
+                done[tuple(entry["shard"])] = entry["checked"]
+            else:
+                other_splits += 1
+    if other_checks:
+        print("Ignoring {} entries of {} checkpointed by a different check".format(other_checks, path))
+    if other_splits:
+        print("Ignoring {} shards of {} checkpointed with a different number of shards".format(other_splits, path))
+    return done, counterexample
+
+
+def _append_checkpoint(path:str, entry:dict):
+    if path is None:
+        return
+    with open(path, "a") as f:
+        f.write(json.dumps(entry) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def run_shards(check_shard, shards:list, n_workers:int=1, checkpoint:str=None, check:dict=None):
+    # Returns the first counterexample found (or None) and the number of
+    # combinations checked, including those of previously completed shards.
+    # `check` identifies the check in the checkpoint, e.g. its script and
+    # parameters, and must be JSON-serialisable
+    done, counterexample = _load_checkpoint(checkpoint, check, len(shards))
+    checked = sum(done.values())
+    if counterexample is not None:
+        print("Counterexample already found in {}".format(checkpoint))
+        return counterexample, checked
+    todo = [s for s in shards if tuple(s) not in done]
+    if done:
+        print("Resuming: {} of {} shards complete".format(len(shards) - len(todo), len(shards)))
+
+    start_time = time.time()
+    run_checked = 0
+
+    def record(shard, result):
+        nonlocal run_checked
+        found, shard_checked = result
+        run_checked += shard_checked
+        if found is not None:
+            _append_checkpoint(checkpoint, {"check" : check, "shard" : list(shard), "n_shards" : len(shards), "counterexample" : found})
+            return found
+        _append_checkpoint(checkpoint, {"check" : check, "shard" : list(shard), "n_shards" : len(shards), "checked" : shard_checked})
+        done[tuple(shard)] = shard_checked
+        elapsed = time.time() - start_time
+        print("shard {}/{} done: {} checked, {:.0f} per second".format(
+            len(done), len(shards), run_checked, run_checked / elapsed if elapsed > 0 else 0.0))
+        return None
+
+    found = None
+    if n_workers == 1:
+        for shard in todo:
+            found = record(shard, check_shard(shard))
+            if found is not None:
+                break
+    else:
+        event = multiprocessing.Event()
+        executor = ProcessPoolExecutor(max_workers=n_workers, initializer=_init_worker, initargs=(event,))
+        try:
+            futures = {executor.submit(check_shard, shard) : shard for shard in todo}
+            for future in as_completed(futures):
+                found = record(futures[future], future.result())
+                if found is not None:
+                    event.set()
+                    break
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+    return found, checked + run_checked
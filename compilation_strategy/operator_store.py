@@ -0,0 +1,203 @@
+# Compact, version-independent store of the benchmark operators.
+#
+# The operators in `operators/{enc}_operators/*.pickle` are pickled
+# `QubitPauliOperator`s with sympy coefficients. They are slow to load,
+# and only load with the pytket version that wrote them. Running this
+# script (with that pytket version installed) converts each encoding to
+# a store directory next to the pickles, `operators/{enc}_operators.store`,
+# holding:
+#
+#   paulis.npy   uint8 array of shape (terms, qubits), one row per term
+#                of every operator: 0 = I, 1 = X, 2 = Y, 3 = Z
+#   coeffs.npy   complex128 array of the numerical coefficient of each
+#                term, NaN where the coefficient is symbolic
+#   index.json   names, qubit counts and term offsets of the operators,
+#                the SHA-256 hash of the pickle each was read from, and
+#                the symbolic coefficients in sympy's srepr form (which
+#                keeps full precision), keyed by term
+#
+# The arrays are memory-mapped when the store is opened, so an operator
+# only reads its own terms. bench.py uses the store for the operators
+# whose pickle is unchanged since the store was written, and falls back
+# to the pickles for the others. Rerunning this script rebuilds a store
+# once any of its pickles has been added, changed or removed.
+
+import hashlib, json, math, os, pickle, shutil, sys
+import numpy as np
+
+PAULI_LETTERS = ["I", "X", "Y", "Z"]
+
+_PAULIS_FILE = "paulis.npy"
+_COEFFS_FILE = "coeffs.npy"
+_INDEX_FILE = "index.json"
+_SUFFIX = ".store"
+
+
+def store_path(op_directory:str):
+    return op_directory.rstrip("/") + _SUFFIX
+
+
+def source_stamp(fpath:str):
+    # SHA-256 hash of a pickle's contents, which tells when its stored
+    # operator is out of date. Unlike modification times, it survives
+    # clones and copies of the operators.
+    with open(fpath, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def _coefficient_entry(coeff):
+    # (numerical value, None) or (NaN, expression string)
+    try:
+        return complex(coeff), None
+    except TypeError:
+        from sympy import srepr
+        return complex(math.nan, math.nan), srepr(coeff)
+
+
+def write_store(path:str, operators, sources:dict=None):
+    # `operators` yields (name, QubitPauliOperator) pairs. Qubits must be
+    # indices of the default register. `sources` maps names to the
+    # `source_stamp` of the pickles they were read from.
+    names, n_qubits, offsets = [], [], [0]
+    rows, coeffs, exprs = [], [], dict()
+    for name, op in operators:
+        terms = list(op._dict.items())
+        width = 0
+        for qps, coeff in terms:
+            for qb in qps.map:
+                if qb.reg_name != "q" or len(qb.index) != 1:
+                    raise ValueError("{}: unsupported qubit {}".format(name, qb))
+                width = max(width, qb.index[0] + 1)
+            value, expr = _coefficient_entry(coeff)
+            if expr is not None:
+                exprs[len(coeffs)] = expr
+            coeffs.append(value)
+            rows.append({qb.index[0] : PAULI_LETTERS.index(p.name) for qb, p in qps.map.items()})
+        names.append(name)
+        n_qubits.append(width)
+        offsets.append(len(rows))
+    paulis = np.zeros((len(rows), max(n_qubits, default=0)), dtype=np.uint8)
+    for i, row in enumerate(rows):
+        for q, letter in row.items():
+            paulis[i, q] = letter
+
+    # Written to a temporary directory and moved into place, so a store is
+    # either complete or absent
+    tmp_path = path + ".tmp"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+    np.save(os.path.join(tmp_path, _PAULIS_FILE), paulis)
+    np.save(os.path.join(tmp_path, _COEFFS_FILE), np.array(coeffs, dtype=np.complex128))
+    with open(os.path.join(tmp_path, _INDEX_FILE), "w") as f:
+        json.dump({"names" : names, "n_qubits" : n_qubits, "offsets" : offsets, "sources" : sources or dict(), "exprs" : exprs}, f)
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp_path, path)
+
+
+class OperatorStore:
+    def __init__(self, path:str):
+        with open(os.path.join(path, _INDEX_FILE)) as f:
+            index = json.load(f)
+        self.path = path
+        self._position = {name : i for i, name in enumerate(index["names"])}
+        self._n_qubits = index["n_qubits"]
+        self._offsets = index["offsets"]
+        self._sources = index.get("sources", dict())
+        self._current = dict()
+        self._exprs = {int(t) : e for t, e in index["exprs"].items()}
+        self._paulis = np.load(os.path.join(path, _PAULIS_FILE), mmap_mode="r")
+        self._coeffs = np.load(os.path.join(path, _COEFFS_FILE), mmap_mode="r")
+
+    def names(self):
+        return list(self._position)
+
+    def __contains__(self, name:str):
+        return name in self._position
+
+    def is_current(self, name:str, fpath:str):
+        # Whether the stored operator was read from the pickle at `fpath`
+        # as it is now. Stores written without stamps are never current.
+        # Each pickle is only hashed once.
+        if name not in self._position:
+            return False
+        if fpath not in self._current:
+            self._current[fpath] = self._sources.get(name) == source_stamp(fpath)
+        return self._current[fpath]
+
+    def _range(self, name:str):
+        i = self._position[name]
+        return self._offsets[i], self._offsets[i + 1]
+
+    def n_terms(self, name:str):
+        start, stop = self._range(name)
+        return stop - start
+
+    def paulis(self, name:str):
+        # Read-only (terms, qubits) array of the operator's Pauli letters
+        start, stop = self._range(name)
+        return self._paulis[start:stop, :self._n_qubits[self._position[name]]]
+
+    def coefficients(self, name:str):
+        # Coefficients as numbers, or sympy expressions where symbolic
+        start, stop = self._range(name)
+        coeffs = []
+        for t in range(start, stop):
+            if t in self._exprs:
+                from sympy import sympify
+                coeffs.append(sympify(self._exprs[t]))
+            else:
+                c = complex(self._coeffs[t])
+                coeffs.append(c.real if c.imag == 0 else c)
+        return coeffs
+
+    def operator(self, name:str):
+        # Rebuilds the operator as a QubitPauliOperator
+        from pytket.circuit import Qubit
+        from pytket.pauli import Pauli, QubitPauliString
+        from pytket.utils import QubitPauliOperator
+        letters = [getattr(Pauli, p) for p in PAULI_LETTERS]
+        terms = dict()
+        for row, coeff in zip(self.paulis(name), self.coefficients(name)):
+            support = np.nonzero(row)[0]
+            qps = QubitPauliString([Qubit(int(q)) for q in support], [letters[row[q]] for q in support])
+            terms[qps] = coeff
+        return QubitPauliOperator(terms)
+
+
+def open_store(op_directory:str):
+    # The store of an operator directory, or None if it hasn't been built
+    path = store_path(op_directory)
+    if not os.path.exists(os.path.join(path, _INDEX_FILE)):
+        return None
+    return OperatorStore(path)
+
+
+def pickle_paths(op_directory:str):
+    # Operator names and the pickles they are read from
+    return {
+        filename.replace(".pickle", "") : os.path.join(op_directory, filename)
+        for filename in sorted(os.listdir(op_directory)) if filename.endswith(".pickle")
+    }
+
+
+def _read_pickles(paths:dict):
+    for name, fpath in paths.items():
+        with open(fpath, "rb") as pickle_in:
+            yield name, pickle.load(pickle_in)
+
+
+if __name__ == "__main__":
+    encodings = sys.argv[1:] or ["BK", "JW", "P"]
+    for encoding_name in encodings:
+        op_directory = "operators/{}_operators".format(encoding_name)
+        path = store_path(op_directory)
+        paths = pickle_paths(op_directory)
+        store = open_store(op_directory)
+        if store is not None and set(store.names()) == set(paths) and all(store.is_current(name, fpath) for name, fpath in paths.items()):
+            print("{}: {} is up to date".format(encoding_name, path))
+            continue
+        # Every stamp is taken before its pickle is read, so a pickle
+        # changed during the rebuild shows up as stale next time
+        sources = {name : source_stamp(fpath) for name, fpath in paths.items()}
+        write_store(path, _read_pickles(paths), sources)
+        print("{}: {} operators written to {}".format(encoding_name, len(OperatorStore(path).names()), path))
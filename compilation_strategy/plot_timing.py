@@ -0,0 +1,69 @@
+# Scaling report for the per-stage timings written by bench.py.
+#
+# For each encoding and stage, fits wall time against active spin
+# orbitals as a power law, t = c * orbitals^b, prints the exponent b and
+# the largest peak memory, and plots the timings with their fits.
+
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas
+import seaborn as sns
+
+stages = ["Sequencing", "Naive", "Pairwise", "Set"]
+
+for encoding in ("JW", "BK", "P"):
+    table = pandas.read_csv("results/{}_results_Stages.csv".format(encoding))
+
+    f, (ax1) = plt.subplots(1, 1)
+    markers = ["v", "p", "x", "."]
+    colours = sns.color_palette("Set2")
+    linestyles = [":", "--", "-.", "-"]
+    for i, stage in enumerate(stages):
+        rows = table[(table["Stage"] == stage) & (table["Wall time"] > 0)]
+        if len(rows) < 2:
+            continue
+        list_spins = rows["Active Spin Orbitals"].to_numpy(dtype=float)
+        list_time = rows["Wall time"].to_numpy(dtype=float)
+        exponent, offset = np.polyfit(np.log10(list_spins), np.log10(list_time), 1)
+        print(
+            "{} {}: wall time ~ {:.3g} * orbitals^{:.2f}, peak memory {:.0f} MiB".format(
+                encoding, stage, 10 ** offset, exponent, rows["Peak RSS (MiB)"].max()
+            )
+        )
+
+        ax1.plot(
+            list_spins,
+            list_time,
+            label=stage,
+            marker=markers[i],
+            markersize=6,
+            c=colours[i],
+            linewidth=0,
+        )
+        fit_spins = np.linspace(list_spins.min(), list_spins.max(), 50)
+        ax1.plot(
+            fit_spins,
+            10 ** offset * fit_spins ** exponent,
+            linewidth=1.1,
+            linestyle=linestyles[i],
+            c=colours[i],
+        )
+
+    ax1.set_xscale("log")
+    ax1.set_yscale("log")
+    ax1.set_xlabel("Active Spin Orbitals")
+    ax1.set_ylabel("Wall time (s)")
+
+    handles, labels = ax1.get_legend_handles_labels()
+    plt.legend(
+        handles=handles,
+        labels=labels,
+        loc="upper left",
+        ncol=2,
+        title="Stage",
+        fancybox=True,
+        handlelength=1,
+        markerscale=1.3,
+    )
+    f.set_size_inches(6, 5, forward=True)
+    plt.savefig("plots/Timing_{}.eps".format(encoding), format="eps", dpi=1000)
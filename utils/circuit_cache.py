@@ -0,0 +1,97 @@
+# Persistent cache of parsed QASM circuits.
+#
+# Parsing the larger benchmark files with `circuit_from_qasm` takes far
+# longer than loading a serialised circuit, and every sweep parses the
+# same files again. Parsed circuits are stored as compressed pickles of
+# `Circuit.to_dict`, keyed by the hash of the QASM text and the pytket
+# version that parsed it. Once the cache grows past its size bound, the
+# least recently used entries are evicted.
+
+import hashlib, os, pickle, zlib
+from importlib.metadata import version as distribution_version
+
+from pytket import Circuit
+
+_DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, ".circuit_cache")
+_DEFAULT_MAX_BYTES = 1 << 30
+_ENTRY_SUFFIX = ".circ"
+
+
+def hash_file(fpath:str):
+    with open(fpath, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+class CircuitCache:
+    def __init__(self, cache_dir:str=_DEFAULT_CACHE_DIR, max_bytes:int=_DEFAULT_MAX_BYTES):
+        self.cache_dir = os.path.normpath(cache_dir)
+        self.max_bytes = max_bytes
+        self.pytket_version = distribution_version("pytket")
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def _entry_path(self, file_hash:str):
+        key = hashlib.sha256("{}:{}".format(file_hash, self.pytket_version).encode()).hexdigest()
+        return os.path.join(self.cache_dir, key + _ENTRY_SUFFIX)
+
+    def load(self, fpath:str, file_hash:str=None):
+        # `file_hash` is the SHA-256 of the QASM file, if already known
+        if file_hash is None:
+            file_hash = hash_file(fpath)
+        entry = self._entry_path(file_hash)
+        try:
+            with open(entry, "rb") as f:
+                circ = Circuit.from_dict(pickle.loads(zlib.decompress(f.read())))
+            os.utime(entry) # Mark as recently used for eviction
+            return circ
+        except (OSError, EOFError, zlib.error, pickle.UnpicklingError):
+            # Missing, evicted by another process, or corrupt: parse again
+            pass
+        return self.parse(fpath, file_hash)
+
+    def parse(self, fpath:str, file_hash:str=None):
+        # Always parses the QASM file, and caches the result. The QASM
+        # parser is only imported when a file actually has to be parsed.
+        from pytket.qasm import circuit_from_qasm
+        if file_hash is None:
+            file_hash = hash_file(fpath)
+        circ = circuit_from_qasm(fpath)
+        self.store(file_hash, circ)
+        return circ
+
+    def store(self, file_hash:str, circ:Circuit):
+        # Caches a circuit parsed elsewhere from the file hashing to
+        # `file_hash`
+        entry = self._entry_path(file_hash)
+        data = zlib.compress(pickle.dumps(circ.to_dict(), pickle.HIGHEST_PROTOCOL), 1)
+        # Write to a private file first so that concurrent readers never
+        # see a partial entry
+        tmp_entry = "{}.{}.tmp".format(entry, os.getpid())
+        with open(tmp_entry, "wb") as f:
+            f.write(data)
+        os.replace(tmp_entry, entry)
+        self._evict()
+
+    def _evict(self):
+        entries = list()
+        total = 0
+        with os.scandir(self.cache_dir) as it:
+            for e in it:
+                if e.name.endswith(_ENTRY_SUFFIX):
+                    st = e.stat()
+                    entries.append((st.st_mtime, st.st_size, e.path))
+                    total += st.st_size
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def clear(self):
+        with os.scandir(self.cache_dir) as it:
+            for e in it:
+                if e.name.endswith(_ENTRY_SUFFIX):
+                    os.remove(e.path)
@@ -0,0 +1,64 @@
+# Circuit metrics computed in a single pass over the command list.
+#
+# `n_gates`, `depth()`, `n_gates_of_type` and `depth_by_type` each walk
+# the whole circuit, so reporting them all walks a large compiled circuit
+# several times. `circuit_metrics` instead goes through the commands once,
+# keeping for every qubit and bit the depth reached so far, both over all
+# gates and over the two-qubit gate types. The results agree with the
+# pytket methods: barriers count as gates but add no depth, and the bits
+# a conditional gate is conditioned on are only read, so gates
+# conditioned on the same bit can share a layer, but must all come before
+# the next gate that writes the bit.
+
+from collections import namedtuple
+
+from pytket import OpType
+
+Metrics = namedtuple("Metrics", ["n_gates", "depth", "n_2qb_gates", "depth_2qb", "t_count"])
+
+_T_TYPES = {OpType.T, OpType.Tdg}
+
+
+def circuit_metrics(circ, two_qb_gates:set):
+    n_gates = 0
+    n_2qb = 0
+    t_count = 0
+    depth = dict()
+    depth_2qb = dict()
+    # Deepest gate reading each bit since it was last written
+    read = dict()
+    read_2qb = dict()
+    for cmd in circ.get_commands():
+        op = cmd.op
+        optype = op.type
+        args = cmd.args
+        n_gates += 1
+        if optype in two_qb_gates:
+            n_2qb += 1
+        if optype in _T_TYPES:
+            t_count += 1
+        # The first `width` arguments of a conditional gate are the bits it
+        # is conditioned on, which it reads without writing
+        n_read = op.width if optype == OpType.Conditional else 0
+        reads, writes = args[:n_read], args[n_read:]
+        d = max([depth.get(u, 0) for u in reads] + [max(depth.get(u, 0), read.get(u, 0)) for u in writes])
+        d2 = max([depth_2qb.get(u, 0) for u in reads] + [max(depth_2qb.get(u, 0), read_2qb.get(u, 0)) for u in writes])
+        if optype != OpType.Barrier:
+            d += 1
+        if optype in two_qb_gates:
+            d2 += 1
+        for u in reads:
+            read[u] = max(read.get(u, 0), d)
+            read_2qb[u] = max(read_2qb.get(u, 0), d2)
+        for u in writes:
+            depth[u] = d
+            depth_2qb[u] = d2
+            read.pop(u, None)
+            read_2qb.pop(u, None)
+    return Metrics(
+        n_gates,
+        max(list(depth.values()) + list(read.values()), default=0),
+        n_2qb,
+        max(list(depth_2qb.values()) + list(read_2qb.values()), default=0),
+        t_count,
+    )
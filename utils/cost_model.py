@@ -0,0 +1,82 @@
+# Predicted compile times, for scheduling the longest jobs first.
+#
+# A circuit's compile time is modelled as a power law in its config
+# metrics (gate count, depth, 2-qubit gate count and depth, qubits):
+#
+#   log(t) = w_0 + sum_i w_i * log(1 + x_i)
+#
+# fitted by least squares to the compile times observed so far. These are
+# read from earlier result files, and the model is refitted as each new
+# result comes in. Until there are enough observations to fit, circuits
+# are ranked by the product of their metrics, which orders them roughly
+# by size.
+
+import glob, math
+import numpy as np
+import pandas
+
+feature_columns = ['Gate count', 'Depth', '2qb gate count', '2qb depth', 'Qubits']
+
+# Result columns holding the compile time, in order of preference
+_TIME_COLUMNS = ['Wall time', 'Time elapsed']
+# Keeps the fit well-posed when some metrics are strongly correlated
+_RIDGE = 1e-3
+
+
+class CostModel:
+    def __init__(self, config:pandas.DataFrame):
+        # Only the metrics the config has are used
+        self.columns = [c for c in feature_columns if c in config.columns]
+        self.features = {
+            row['Filename'] : np.log1p(np.array([float(row[c]) for c in self.columns]))
+            for row in config.to_dict('records')
+        }
+        self._x = list()
+        self._y = list()
+        self._weights = None
+
+    def observe(self, filename:str, seconds:float):
+        if filename not in self.features or not seconds > 0:
+            return
+        self._x.append(self.features[filename])
+        self._y.append(math.log(seconds))
+        self._weights = None
+
+    def load_results(self, pattern:str):
+        # Observes the compile times in result files matching a glob
+        # pattern. Returns the number of times observed.
+        n = len(self._y)
+        for path in sorted(glob.glob(pattern)):
+            try:
+                table = pandas.read_csv(path)
+            except (OSError, ValueError):
+                continue
+            # Every results file has 'Time elapsed', which tells them apart
+            # from side-car files such as the per-stage timings
+            if 'Filename' not in table.columns or 'Time elapsed' not in table.columns:
+                continue
+            time_column = next(c for c in _TIME_COLUMNS if c in table.columns)
+            if 'Status' in table.columns:
+                table = table[table['Status'] == "OK"]
+            for filename, seconds in zip(table['Filename'], table[time_column]):
+                self.observe(filename, seconds)
+        return len(self._y) - n
+
+    def _fit(self):
+        x = np.column_stack([np.ones(len(self._x)), np.array(self._x)])
+        y = np.array(self._y)
+        gram = x.T @ x + _RIDGE * np.eye(x.shape[1])
+        self._weights = np.linalg.solve(gram, x.T @ y)
+
+    def predict(self, filename:str):
+        # Predicted compile time in seconds, or a relative size while there
+        # are too few observations to fit
+        x = self.features[filename]
+        if len(self._y) < len(self.columns) + 2:
+            return float(np.exp(x.sum()))
+        if self._weights is None:
+            self._fit()
+        return float(np.exp(self._weights[0] + x @ self._weights[1:]))
+
+    def longest_first(self, filenames:list):
+        return sorted(filenames, key=self.predict, reverse=True)
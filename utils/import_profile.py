@@ -0,0 +1,68 @@
+# Import-time profile of a benchmark script's start-up.
+#
+# Runs a snippet of Python in a fresh interpreter with `-X importtime`
+# and collects the time spent importing each module, so that a report
+# can show where start-up goes and a slow new import stands out. Times are
+# in microseconds, as reported by the interpreter. Cumulative times
+# include everything a module imports in turn. `top_level` summarises the
+# snippet's own imports. `breakdown` splits one of them, such as a
+# benchmark script, into the modules it imports directly and the imports
+# made after it.
+#
+#   python import_profile.py pytket pandas
+
+from collections import namedtuple
+import subprocess, sys
+
+ImportTime = namedtuple("ImportTime", ["module", "self_us", "cumulative_us", "level"])
+
+_PREFIX = "import time:"
+
+
+def profile_imports(code:str, cwd:str=None):
+    # Every module imported while running `code`, in the order their
+    # imports finished
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", code], cwd=cwd, capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError("profiled code failed:\n" + proc.stderr)
+    entries = list()
+    for line in proc.stderr.splitlines():
+        if not line.startswith(_PREFIX):
+            continue
+        fields = line[len(_PREFIX):].split("|")
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            continue # The header line
+        name = fields[2].rstrip()
+        stripped = name.lstrip()
+        level = (len(name) - len(stripped)) // 2
+        entries.append(ImportTime(stripped, int(fields[0]), int(fields[1]), level))
+    return entries
+
+
+def top_level(entries:list):
+    # The imports made directly by the profiled code, slowest first
+    return sorted((e for e in entries if e.level == 0), key=lambda e: e.cumulative_us, reverse=True)
+
+
+def breakdown(entries:list, module:str):
+    # The modules imported directly by the top-level import of `module`,
+    # and the top-level imports made after it, slowest first. A module's
+    # imports are listed before it, back to the previous top-level entry.
+    i = next(i for i, e in enumerate(entries) if e.level == 0 and e.module == module)
+    j = i
+    while j > 0 and entries[j - 1].level > 0:
+        j -= 1
+    children = [e for e in entries[j:i] if e.level == 1]
+    later = [e for e in entries[i + 1:] if e.level == 0]
+    return sorted(children + later, key=lambda e: e.cumulative_us, reverse=True)
+
+
+def total_us(entries:list):
+    return sum(e.cumulative_us for e in entries if e.level == 0)
+
+
+if __name__ == "__main__":
+    entries = profile_imports("import " + ", ".join(sys.argv[1:]))
+    print("Total import time: {:.1f} ms".format(total_us(entries) / 1e3))
+    for e in top_level(entries)[:20]:
+        print("{:>10.1f} ms  {}".format(e.cumulative_us / 1e3, e.module))
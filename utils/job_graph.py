@@ -0,0 +1,56 @@
+# Priority-ordered runner for a graph of benchmark jobs.
+#
+# A job is a function and its arguments, tagged by the caller, with a
+# priority that is a number or a tuple of numbers. Jobs are started
+# highest priority first, and at most `n_workers` run at a time,
+# in a process pool (or in this process when n_workers is 1). Only as
+# many jobs as there are workers are handed to the pool, so a job that
+# becomes ready later still overtakes lower-priority jobs that are
+# waiting.
+#
+# When a job finishes, `done(tag, result)` is called in this process and
+# returns the jobs that now become ready, e.g. the strategies that need
+# the circuit a job has just built. This is how dependencies between
+# jobs are expressed.
+
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+import heapq, itertools
+
+Job = namedtuple("Job", ["priority", "tag", "fn", "args"])
+
+
+def _heap_key(priority):
+    # heapq pops the smallest key first
+    if isinstance(priority, tuple):
+        return tuple(-p for p in priority)
+    return -priority
+
+
+def run_jobs(jobs:list, done, n_workers:int=1, initializer=None, initargs:tuple=()):
+    counter = itertools.count() # Ties go to the job made ready first
+    ready = []
+
+    def push(new_jobs):
+        for job in new_jobs or ():
+            heapq.heappush(ready, (_heap_key(job.priority), next(counter), job))
+
+    push(jobs)
+    if n_workers == 1:
+        if initializer is not None:
+            initializer(*initargs)
+        while ready:
+            _, _, job = heapq.heappop(ready)
+            push(done(job.tag, job.fn(*job.args)))
+        return
+
+    with ProcessPoolExecutor(max_workers=n_workers, initializer=initializer, initargs=initargs) as executor:
+        running = dict()
+        while ready or running:
+            while ready and len(running) < n_workers:
+                _, _, job = heapq.heappop(ready)
+                running[executor.submit(job.fn, *job.args)] = job.tag
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                tag = running.pop(future)
+                push(done(tag, future.result()))
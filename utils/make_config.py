@@ -1,13 +1,112 @@
-from pytket import Circuit, circuit_from_qasm, OpType
-import os, pandas
-
-stat_table = pandas.DataFrame({})
-for filename in os.listdir("qasm_files"):
-    fpath = os.path.join("qasm_files", filename)
-    circ = circuit_from_qasm(fpath)
-    new_stats = [[filename, circ.n_gates, circ.depth(), circ.n_gates_of_type(OpType.CX), circ.depth_by_type(OpType.CX)]]
-    new_table_row = pandas.DataFrame(new_stats, columns = ['Filename','Gate count', 'Depth', '2qb gate count', '2qb depth'])
-    stat_table = stat_table.append(new_table_row)
-stat_table = stat_table.sort_values(by=['2qb gate count','2qb depth'])
-stat_table.to_csv("tket_paper_config.csv", index=False)
-    
\ No newline at end of file
+# Builds the config CSV of a directory of QASM circuits, e.g.
+#
+#   cd active && python ../utils/make_config.py -d qasm_files -j 4
+#
+# Each circuit is parsed once and its gate metrics recorded, along with
+# its qubit count, file size and parse time, which the benchmark scripts
+# can use to balance work across their workers. Files are processed by
+# -j worker processes. Rows of an existing config are kept for files
+# whose hash and pytket version still match, so only new or changed
+# files are parsed again. Parsed circuits go into the circuit cache, so
+# the first benchmark sweep after building a config skips parsing.
+
+import getopt, os, sys
+from concurrent.futures import ProcessPoolExecutor
+from importlib.metadata import version as distribution_version
+import pandas
+
+from pytket import OpType
+from pytket.qasm import circuit_from_qasm
+from circuit_cache import CircuitCache, hash_file
+from circuit_metrics import circuit_metrics
+from measure import measure_once
+
+# Configs the benchmark scripts expect for their circuit sets. Other
+# directories get <directory>_config.csv.
+default_configs = {"qasm_files" : "tket_paper_config.csv", "chem_qasm" : "chem_config.csv"}
+
+config_columns = ['Filename', 'Gate count', 'Depth', '2qb gate count', '2qb depth', 'Qubits', 'File size', 'Parse time', 'File hash', 'Pytket version']
+
+circuit_cache = None
+
+
+def usage():
+    print("usage: {source} [-d <directory>] [-o <config>] [-j <workers>]".format(source=sys.argv[0]))
+    print("<directory> = directory of QASM files, qasm_files (default)")
+    print("<config> = output file, {} for the benchmark sets, otherwise <directory>_config.csv".format(default_configs))
+    print("<workers> = number of worker processes, 1 (default) runs serially")
+
+
+def init_worker():
+    global circuit_cache
+    circuit_cache = CircuitCache()
+
+
+def scan_file(fpath:str, fhash:str):
+    # Only the parse itself is timed, not the caching of its result
+    circ, sample = measure_once(circuit_from_qasm, (fpath,))
+    circuit_cache.store(fhash, circ)
+    m = circuit_metrics(circ, {OpType.CX})
+    return [os.path.basename(fpath), m.n_gates, m.depth, m.n_2qb_gates, m.depth_2qb, circ.n_qubits, os.path.getsize(fpath), sample.wall, fhash]
+
+
+if __name__ == "__main__":
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "d:o:j:")
+    except getopt.GetoptError as err:
+        print(err)
+        usage()
+        exit()
+
+    directory = "qasm_files"
+    configfile = None
+    n_workers = 1
+    for o, v in opts:
+        if o == "-d":
+            directory = v
+        elif o == "-o":
+            configfile = v
+        elif o == "-j":
+            if not v.isdigit() or int(v) < 1:
+                print("invalid number of workers: " + v)
+                usage()
+                exit()
+            n_workers = int(v)
+
+    dir_name = os.path.basename(os.path.normpath(directory))
+    if configfile is None:
+        configfile = default_configs.get(dir_name, dir_name + "_config.csv")
+    pytket_version = distribution_version("pytket")
+
+    filenames = sorted(f for f in os.listdir(directory) if f.endswith(".qasm"))
+    hashes = {f : hash_file(os.path.join(directory, f)) for f in filenames}
+
+    # Rows of the previous config that are still up to date
+    rows = list()
+    if os.path.exists(configfile):
+        old_table = pandas.read_csv(configfile)
+        if list(old_table.columns) == config_columns:
+            for row in old_table.itertuples(index=False):
+                if hashes.get(row[0]) == row[-2] and str(row[-1]) == pytket_version:
+                    rows.append(list(row))
+    up_to_date = {row[0] for row in rows}
+    todo = [f for f in filenames if f not in up_to_date]
+    print("{} of {} files to scan".format(len(todo), len(filenames)))
+
+    paths = [os.path.join(directory, f) for f in todo]
+    fhashes = [hashes[f] for f in todo]
+    if n_workers == 1:
+        init_worker()
+        scanned = map(scan_file, paths, fhashes)
+    else:
+        executor = ProcessPoolExecutor(max_workers=n_workers, initializer=init_worker)
+        scanned = executor.map(scan_file, paths, fhashes)
+    for row in scanned:
+        print(row[0])
+        rows.append(row + [pytket_version])
+    if n_workers > 1:
+        executor.shutdown()
+
+    stat_table = pandas.DataFrame(rows, columns=config_columns)
+    stat_table = stat_table.sort_values(by=['2qb gate count', '2qb depth', 'Filename'])
+    stat_table.to_csv(configfile, index=False)
@@ -0,0 +1,95 @@
+# Measurement harness shared by the benchmark scripts.
+#
+# Every compiler is measured the same way: wall-clock time, CPU time of
+# this process, CPU time of any child processes, CPU time spent in a
+# remote compiler server where the caller can report it, and peak
+# resident memory. A measurement can be repeated after some warm-up runs,
+# and `summarise` reduces the samples to their median and spread.
+
+from collections import namedtuple
+import math, resource, statistics, sys, time
+
+Sample = namedtuple("Sample", ["wall", "cpu", "child_cpu", "remote_cpu", "peak_rss"])
+Summary = namedtuple("Summary", ["median", "spread", "minimum"])
+
+_PROC_CLEAR_REFS = "/proc/self/clear_refs"
+_PROC_STATUS = "/proc/self/status"
+
+
+def reset_peak_rss():
+    # Linux lets the peak RSS be reset to the current RSS, so that each
+    # measurement sees its own peak rather than the process' lifetime peak.
+    # Returns False where that isn't supported.
+    try:
+        with open(_PROC_CLEAR_REFS, "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_mb():
+    # Peak resident set size of this process, in MiB
+    try:
+        with open(_PROC_STATUS) as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / (1 << 10)
+    except OSError:
+        pass
+    # ru_maxrss is in KiB on Linux but in bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        return rss / (1 << 20)
+    return rss / (1 << 10)
+
+
+def _child_cpu():
+    ru = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return ru.ru_utime + ru.ru_stime
+
+
+def measure_once(fn, args:tuple=(), remote_cpu=None):
+    # Times `fn(*args)`. `remote_cpu` returns the CPU seconds used so far
+    # by a remote server, if known.
+    reset_peak_rss()
+    remote_start = remote_cpu() if remote_cpu is not None else None
+    child_start = _child_cpu()
+    start_time = time.process_time()
+    start_wall = time.perf_counter()
+    result = fn(*args)
+    wall = time.perf_counter() - start_wall
+    cpu = time.process_time() - start_time
+    child_cpu = _child_cpu() - child_start
+    remote = remote_cpu() - remote_start if remote_start is not None else math.nan
+    return result, Sample(wall, cpu, child_cpu, remote, peak_rss_mb())
+
+
+def measure(fn, setup=None, repeat:int=1, warmup:int=0, remote_cpu=None):
+    # Runs `fn` warmup + repeat times and returns the results and samples
+    # of the timed runs. If `setup` is given, it is called untimed before
+    # every run and its result passed to `fn`, e.g. to give each run a
+    # fresh copy of its input.
+    for _ in range(warmup):
+        fn(*(() if setup is None else (setup(),)))
+    results = list()
+    samples = list()
+    for _ in range(repeat):
+        result, sample = measure_once(fn, () if setup is None else (setup(),), remote_cpu)
+        results.append(result)
+        samples.append(sample)
+    return results, samples
+
+
+def summarise(values:list):
+    # Median, interquartile range and minimum of a list of measurements
+    values = sorted(values)
+    if len(values) < 2:
+        return Summary(values[0], 0.0, values[0])
+    q1, _, q3 = statistics.quantiles(values, n=4, method="inclusive")
+    return Summary(statistics.median(values), q3 - q1, values[0])
+
+
+def median_sample(samples:list):
+    # The per-field median of a list of samples
+    return Sample(*(statistics.median(field) for field in zip(*samples)))
@@ -0,0 +1,73 @@
+# Streaming pre-scan of OpenQASM 2.0 files.
+#
+# Some decisions about a circuit only need its register sizes and rough
+# gate counts, e.g. whether it fits on a device. `scan_qasm` reads these
+# from the file one line at a time without building a circuit, in memory
+# independent of the file size and several times faster than
+# `circuit_from_qasm`. Gate counts are by statement: a gate applied to
+# whole registers counts once, a conditional gate counts as the gate it
+# applies, and the bodies of gate definitions are not counted.
+
+from collections import Counter, namedtuple
+import re
+
+QasmScan = namedtuple("QasmScan", ["n_qubits", "n_bits", "gate_counts"])
+
+_REGISTER = re.compile(r"^(qreg|creg)\s+\w+\s*\[\s*(\d+)\s*\]$")
+_NAME = re.compile(r"^([A-Za-z_]\w*)")
+_CONDITION = re.compile(r"^if\s*\([^)]*\)\s*")
+_HEADER = {"OPENQASM", "include", "gate", "opaque", "qreg", "creg"}
+
+# Two-qubit gates of qelib1.inc, and the others pytket reads
+TWO_QUBIT_GATES = {"cx", "CX", "cy", "cz", "ch", "crx", "cry", "crz", "cu1", "cu3", "swap", "rxx", "ryy", "rzz", "iswap"}
+
+
+def scan_qasm(fpath:str):
+    n_qubits = 0
+    n_bits = 0
+    gate_counts = Counter()
+    depth = 0 # Nesting of gate definition bodies
+    partial = "" # Statement continued from the previous line
+    with open(fpath) as f:
+        for line in f:
+            line = line.split("//", 1)[0]
+            if not line.strip():
+                continue
+            text = partial + line
+            partial = ""
+            # Braces open and close gate definitions, whose statements
+            # are not applications
+            statements = re.split(r"([;{}])", text)
+            for stmt, sep in zip(statements[0::2], statements[1::2] + [None]):
+                stmt = stmt.strip()
+                if sep is None:
+                    partial = stmt + " " if stmt else ""
+                    break
+                if sep == "{":
+                    depth += 1
+                    continue
+                if sep == "}":
+                    depth -= 1
+                    continue
+                if depth > 0 or not stmt:
+                    continue
+                reg = _REGISTER.match(stmt)
+                if reg is not None:
+                    if reg.group(1) == "qreg":
+                        n_qubits += int(reg.group(2))
+                    else:
+                        n_bits += int(reg.group(2))
+                    continue
+                name = _NAME.match(_CONDITION.sub("", stmt))
+                if name is None or name.group(1) in _HEADER:
+                    continue
+                gate_counts[name.group(1)] += 1
+    return QasmScan(n_qubits, n_bits, gate_counts)
+
+
+def scan_metrics(scan:QasmScan):
+    # Gate count and 2-qubit gate count of a scan, as estimates of the
+    # config metrics
+    n_gates = sum(n for name, n in scan.gate_counts.items() if name not in ("measure", "barrier", "reset"))
+    n_2qb = sum(n for name, n in scan.gate_counts.items() if name in TWO_QUBIT_GATES)
+    return n_gates, n_2qb
@@ -0,0 +1,112 @@
+# Streaming result writer shared by the benchmark scripts.
+#
+# Rows are appended to the results CSV one at a time as they are
+# produced, and each write is flushed and fsynced so that a crashed or
+# killed run keeps every row it finished. The full table is only built
+# once, when the writer is finalised, at which point the CSV is
+# rewritten in its final order and optionally also saved in a columnar
+# format.
+#
+# A writer opened with `resume=True` appends to an existing results file
+# instead of replacing it. The rows already on disk are exposed as
+# `existing`, and the caller passes the ones it wants to keep back in
+# through `keep` so they appear in the final table.
+
+import csv, math, os
+import pandas
+
+_FORMAT_CSV = "csv"
+_FORMAT_PARQUET = "parquet"
+
+columnar_formats = (_FORMAT_PARQUET,)
+
+
+def _csv_value(v):
+    # Match pandas' to_csv, which writes missing values as empty fields
+    if isinstance(v, float) and math.isnan(v):
+        return ""
+    return v
+
+
+def _trim_partial_row(path:str):
+    # Drop a trailing row that was cut short by a crash mid-write
+    with open(path, "rb+") as f:
+        data = f.read()
+        if data and not data.endswith(b"\n"):
+            f.truncate(data.rfind(b"\n") + 1)
+
+
+class ResultWriter:
+    def __init__(self, path:str, columns:list, columnar:str=None, resume:bool=False):
+        if columnar is not None:
+            if columnar not in columnar_formats:
+                raise ValueError("unsupported columnar format: " + columnar)
+            try:
+                import pyarrow
+            except ImportError:
+                raise ImportError("writing {} results requires pyarrow".format(columnar))
+        self.path = path
+        self.columns = list(columns)
+        self.columnar = columnar
+        self._rows = []
+        self._order = []
+        self.existing = pandas.DataFrame(columns=self.columns)
+        if resume and os.path.exists(path) and os.path.getsize(path) > 0:
+            _trim_partial_row(path)
+            table = pandas.read_csv(path)
+            # Results written with a different set of columns can't be
+            # resumed, so the run starts over
+            if list(table.columns) == self.columns:
+                self.existing = table
+            else:
+                resume = False
+        else:
+            resume = False
+        self._file = open(path, "a" if resume else "w", newline="")
+        self._writer = csv.writer(self._file)
+        if not resume:
+            self._writer.writerow(self.columns)
+        self._sync()
+
+    def _sync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def write(self, row:list, order=None):
+        # `order` is an optional sort key for rows that arrive out of order
+        if len(row) != len(self.columns):
+            raise ValueError("expected {} values, got {}".format(len(self.columns), len(row)))
+        self._writer.writerow([_csv_value(v) for v in row])
+        self._sync()
+        self._rows.append(list(row))
+        self._order.append(len(self._order) if order is None else order)
+
+    def keep(self, row:list, order=None):
+        # Carry a previously written row over into the final table
+        self._rows.append(list(row))
+        self._order.append(len(self._order) if order is None else order)
+
+    def finalise(self, sort_by:list=None):
+        # Build the table once, rewrite the CSV in its final order and
+        # return the table
+        if not self._file.closed:
+            self._file.close()
+        rows = [r for _, r in sorted(zip(self._order, self._rows), key=lambda p: p[0])]
+        table = pandas.DataFrame(rows, columns=self.columns)
+        if sort_by is not None:
+            table = table.sort_values(by=sort_by)
+        tmp_path = self.path + ".tmp"
+        table.to_csv(tmp_path, index=False)
+        os.replace(tmp_path, self.path)
+        if self.columnar == _FORMAT_PARQUET:
+            table.to_parquet(os.path.splitext(self.path)[0] + ".parquet", index=False)
+        return table
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        # Leave the streamed rows on disk untouched if the run failed
+        if not self._file.closed:
+            self._file.close()
+        return False
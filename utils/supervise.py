@@ -0,0 +1,90 @@
+# Supervised execution of a single benchmark job.
+#
+# The job runs in a forked child process while the parent watches its
+# wall-clock time and resident memory. A job that runs past its timeout
+# or grows past its memory cap is killed, and reported as TIMEOUT or OOM
+# rather than taking the whole sweep down with it. Forking means the
+# child inherits everything the parent has already set up (compilation
+# passes, devices, caches), so supervision is only available on platforms
+# with fork. The memory cap is enforced by reading /proc, and is ignored
+# where that isn't available.
+
+import multiprocessing, signal, time
+
+STATUS_OK = "OK"
+STATUS_ERROR = "ERROR"
+STATUS_TIMEOUT = "TIMEOUT"
+STATUS_OOM = "OOM"
+STATUS_SKIPPED = "SKIPPED"
+
+_RETURNED = "returned"
+_RAISED = "raised"
+_POLL_INTERVAL = 0.05
+
+
+def _rss_mb(pid:int):
+    try:
+        with open("/proc/{}/status".format(pid)) as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / (1 << 10)
+    except OSError:
+        pass
+    return 0.0
+
+
+def _child(conn, fn, args):
+    try:
+        result = fn(*args)
+        conn.send((_RETURNED, result))
+    except MemoryError:
+        conn.send((STATUS_OOM, None))
+    except Exception as e:
+        try:
+            conn.send((_RAISED, e))
+        except Exception:
+            # The exception itself couldn't be pickled
+            conn.send((_RAISED, RuntimeError(repr(e))))
+    finally:
+        conn.close()
+
+
+def run_supervised(fn, args:tuple=(), timeout:float=None, max_rss_mb:float=None):
+    # Runs `fn(*args)` in a child process and returns (status, result),
+    # where result is None unless the status is OK. An exception raised
+    # by `fn` is raised again here.
+    ctx = multiprocessing.get_context("fork")
+    recv_conn, send_conn = ctx.Pipe(duplex=False)
+    proc = ctx.Process(target=_child, args=(send_conn, fn, args))
+    proc.start()
+    send_conn.close()
+    deadline = None if timeout is None else time.monotonic() + timeout
+    status = None
+    try:
+        while True:
+            if recv_conn.poll(_POLL_INTERVAL):
+                try:
+                    outcome, value = recv_conn.recv()
+                except EOFError:
+                    break # The child died without reporting back
+                if outcome == _RETURNED:
+                    return STATUS_OK, value
+                elif outcome == _RAISED:
+                    raise value
+                status = outcome
+                break
+            if deadline is not None and time.monotonic() > deadline:
+                status = STATUS_TIMEOUT
+                break
+            if max_rss_mb is not None and _rss_mb(proc.pid) > max_rss_mb:
+                status = STATUS_OOM
+                break
+    finally:
+        if proc.is_alive():
+            proc.kill()
+        proc.join()
+        recv_conn.close()
+    if status is None:
+        # Killed from outside, most likely by the kernel's OOM killer
+        status = STATUS_OOM if proc.exitcode == -signal.SIGKILL else STATUS_ERROR
+    return status, None